@@ -1,13 +1,14 @@
-from random import choice, randint
 from constants import EmployeeType
 from messaging import Message
-import libtcodpy as libtcod
+from pathing import Route, FlowRoute
 
 """This module handle Artifical Intelligence stuff."""
 class EmployeeBehaviour(object):
     WANDER = 0
     TASK_MOVE = 1
     TASK_DO = 2
+    # Longest pause of an employee standing still, in ticks
+    WANDER_PAUSE = 5
 
     def __init__(self, locator, employeeType):
         # A reference to this employee localisation
@@ -15,6 +16,9 @@ class EmployeeBehaviour(object):
         self.employeeType = employeeType
         self.currentTask = None
         self.currentPath = None
+        # Tick of our last update, and ticks since the one before
+        self.lastUpdate = None
+        self.elapsed = 1
         self.set_behaviour(EmployeeBehaviour.WANDER)
 
     def set_behaviour(self, behaviour):
@@ -24,14 +28,32 @@ class EmployeeBehaviour(object):
         return self.behaviour == EmployeeBehaviour.WANDER
 
     def update(self, facility):
-        potential_behaviours = facility.get_task_for_type(self.employeeType)
-        has_task = len(potential_behaviours) > 0
-        if self.is_idle() and has_task:
-            task = potential_behaviours[0]
-            self.set_behaviour(EmployeeBehaviour.TASK_MOVE)
-            self.moveToTask(task, facility)
-        else:
-            self.follow_behaviour(facility)
+        """Tasks are given to idle employees by the facility, before
+        this is called. We are not updated every tick : only when the
+        wake-up we asked for is due."""
+        now = facility.wakeUps.now
+        if self.lastUpdate is not None:
+            self.elapsed = now - self.lastUpdate
+        self.lastUpdate = now
+        self.follow_behaviour(facility)
+
+    def next_update(self, facility):
+        """Ticks until we have something to do again."""
+        if self.behaviour == EmployeeBehaviour.TASK_DO:
+            taskType = self.currentTask.taskType
+            return max(1, EmployeeBehaviour.durations[taskType](self, facility))
+        if self.behaviour == EmployeeBehaviour.WANDER \
+                and self.location.dirX == 0 and self.location.dirY == 0:
+            return 1 + int(facility.draw() * EmployeeBehaviour.WANDER_PAUSE)
+        # One step per tick
+        return 1
+
+    def take_task(self, task, facility):
+        # Time spent idle is not time spent working
+        self.lastUpdate = None
+        self.elapsed = 1
+        self.set_behaviour(EmployeeBehaviour.TASK_MOVE)
+        self.moveToTask(task, facility)
 
     def follow_behaviour(self, facility):
         self.behaviours[self.behaviour](self, facility)
@@ -43,61 +65,111 @@ class EmployeeBehaviour(object):
 
     def wander(self, facility):
         """Randomly move to a direction, stopping and changing
-        direction in the meantime."""
-        random_decision = randint(0,2)
-        if random_decision == 1:
-            potential_moves = [(1,0), (-1,0)]
-            move = choice(potential_moves)
-            self.location.moveTowards(move[0], move[1])
-        elif random_decision == 2:
+        direction in the meantime. One draw decides what to do, and
+        where to go."""
+        random_decision = facility.draw() * 3
+        if random_decision >= 2:
             self.location.moveTowards(0,0)
+        elif random_decision >= 1.5:
+            self.location.moveTowards(1,0)
+        elif random_decision >= 1:
+            self.location.moveTowards(-1,0)
 
     def moveToTask(self, task, facility):
-        """Compute a move to a given task. Called when taking a task."""
-        taskX = task.location.getX()
-        taskY = task.location.getY()
-        close_tiles = facility.circulation.free_surrounding_tiles_of(taskX,
-                                                                    taskY)
-        closest = closest_tile_from(self.location.getX(),
-                                    self.location.getY(),
-                                    close_tiles)
+        """Compute a move to a given task. Called when taking a task.
+        Large dig regions share a flow field leading to any of their
+        tasks : we might end up doing another task of the region."""
+        field = facility.circulation.flow_field_for(task.location.getX(),
+                                                    task.location.getY())
+        if self.is_next_to(task):
+            # Already there : an empty path would look like no path
+            self.location.freeze()
+            self.set_behaviour(EmployeeBehaviour.TASK_DO)
+        elif field is not None:
+            # Take the task the field leads to, rather than swap on arrival
+            end = field.end_of_route(self.location.x, self.location.y)
+            task = facility.dig_next_to(end[0], end[1]) or task
+            self.currentPath = FlowRoute(field, self.location)
+        elif not self.approach(task, facility):
+            facility.give_up_task(task)
+            self.back_to_idleness()
+            return
+        self.currentTask = task
+        facility.consume_task(self.currentTask)
+
+    def approach(self, task, facility):
+        """Ask for a path to the closest free tile next to a task.
+        Tiles that cannot be reached are left out before any path search.
+        Serve False if there is no such tile."""
+        x = self.location.getX()
+        y = self.location.getY()
+        circulation = facility.circulation
+        close_tiles = [tile for tile in
+                    circulation.free_surrounding_tiles_of(task.location.getX(),
+                                                        task.location.getY())
+                    if circulation.is_reachable(x, y, tile[0], tile[1])]
+        closest = closest_tile_from(x, y, close_tiles)
         if closest is None:
+            return False
+        self.moveTo(closest[0], closest[1], facility)
+        return True
+
+    def reach_task(self, facility):
+        """Called at the end of a route. Start working if we are next to
+        our task. Otherwise, a flow field led us next to another task of
+        the region : swap them, or go to our task the usual way."""
+        if self.is_next_to(self.currentTask):
+            self.set_behaviour(EmployeeBehaviour.TASK_DO)
+            return
+        task = facility.take_dig_next_to(self.location.getX(),
+                                        self.location.getY())
+        if task is not None:
+            facility.release_task(self.currentTask)
+            self.currentTask = task
+            self.set_behaviour(EmployeeBehaviour.TASK_DO)
+            return
+        if not self.approach(self.currentTask, facility):
+            facility.give_up_task(self.currentTask)
             self.back_to_idleness()
-            # Ideally, mark the task as "currently unreachable" to avoid
-            # repeting this too often
-        else:
-            self.moveTo(closest[0], closest[1], facility)
-            if self.currentPath is not None:
-                self.currentTask = task
-                facility.consume_task(self.currentTask)
-            else:
-                self.back_to_idleness()
+
+    def is_next_to(self, task):
+        return abs(task.location.getX() - self.location.getX()) <= 1 \
+                and abs(task.location.getY() - self.location.getY()) <= 1
 
     def moveTo(self, x, y, facility):
-        """Cancel the current path and take a general direction.
-        If the move is illegal, do not change the current path."""
+        """Cancel the current path and ask for a new one. Paths asked
+        during a tick are computed together, and given to path_found
+        before anybody moves."""
         self.currentPath = None
-        self.currentPath = facility.circulation.path_from_to(self.location.getX(),
+        facility.circulation.request_path(self,
+                                        self.location.getX(),
                                         self.location.getY(),
                                         x,
                                         y)
-        if libtcod.path_size(self.currentPath) == 0:
-            libtcod.path_delete(self.currentPath)
-            self.currentPath = None
+
+    def path_found(self, steps, facility):
+        if len(steps) > 0:
+            self.currentPath = Route(steps)
+        else:
+            if self.currentTask is not None:
+                facility.give_up_task(self.currentTask)
+            self.back_to_idleness()
 
     def move(self, facility):
         """Follow the current path toward a given direction."""
-        x,y = libtcod.path_walk(self.currentPath, False)
+        if self.currentPath is None:
+            # Still waiting for path_found
+            return
+        x,y = self.currentPath.walk()
         if x is not None:
             self.location.moveTowards(x - self.location.x, y - self.location.y)
         else:
-            # Path has been followed : delete it !
-            libtcod.path_delete(self.currentPath)
+            # Path has been followed : forget it !
             self.currentPath = None
             # STOP THE MOVEMENT !
             self.location.freeze()
             if self.currentTask is not None:
-                self.set_behaviour(EmployeeBehaviour.TASK_DO)
+                self.reach_task(facility)
             else:
                 self.set_behaviour(EmployeeBehaviour.WANDER)
 
@@ -109,11 +181,17 @@ class EmployeeBehaviour(object):
             self.back_to_idleness()
 
     def dig(self, facility):
+        """One stroke per tick since our last update : we sleep until
+        the tile is open."""
         tile = facility.tiles[self.currentTask.location.getX()]\
                         [self.currentTask.location.getY()]
-        tile.dig()
+        tile.dig(self.elapsed)
         return not tile.solid
 
+    def dig_duration(self, facility):
+        return facility.tiles.get_resistance(self.currentTask.location.getX(),
+                                            self.currentTask.location.getY())
+
     # Class-level map to functions
     behaviours = {WANDER : wander,
             TASK_MOVE : move,
@@ -121,6 +199,9 @@ class EmployeeBehaviour(object):
 
     tasks = { Message.DIG : dig }
 
+    # Ticks a task still needs
+    durations = { Message.DIG : dig_duration }
+
 def manhattan(x1, y1, x2, y2):
     return abs(x1-x2) - abs(y1-y2)
 
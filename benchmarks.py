@@ -0,0 +1,610 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Rough benchmarks for SecFac. Run this file to print the numbers."""
+
+import os
+import random
+import time
+
+from constants import GROUND, MAP_WIDTH, MAP_HEIGHT, EmployeeType
+from messaging import Message, Messenger
+from facility import build_tiles, walk_compute, FacilityPath, \
+        SecureFacility, Task, TaskStore, EmployeeStore, PathProcesses, \
+        depth_bands
+from pathing import FlowField, HierarchicalPaths, JumpPointPathEngine, \
+        NumpyPathEngine, numpy
+import savegame
+import libtcodpy as libtcod
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class ObjectTile(object):
+    """The former tile representation : one object per tile."""
+    def __init__(self, depth):
+        self.depth = depth
+        self.solid = self.depth > GROUND
+        self.resistance = 5
+
+def build_object_tiles():
+    return [[ ObjectTile(y)
+                for y in range(MAP_HEIGHT) ]
+                for x in range(MAP_WIDTH) ]
+
+def measure(function, repeat = 5):
+    """Return the best time (in ms) of several calls to function, and the
+    memory (in KB) still allocated by the value it returns, if any."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = (time.time() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    memory = None
+    if tracemalloc is not None and function() is not None:
+        tracemalloc.start()
+        value = function()
+        memory = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+        del value
+    return best, memory
+
+def report(label, result):
+    elapsed, memory = result
+    if memory is None:
+        print("%-40s %10.2f ms" % (label, elapsed))
+    else:
+        print("%-40s %10.2f ms %10d KB" % (label, elapsed, memory))
+
+def dig_galleries(tiles, levels = 8, spacing = 6):
+    """Open a serpentine network of galleries linked by shafts, so that
+    going to the bottom means crossing the whole map several times."""
+    for level in range(levels):
+        y = GROUND + spacing * (level + 1)
+        for x in range(1, MAP_WIDTH - 1):
+            tiles.set_solid(x, y, False)
+        shaft = MAP_WIDTH - 2 if level % 2 == 0 else 1
+        for depth in range(y - spacing + 1, y):
+            tiles.set_solid(shaft, depth, False)
+    return (1, GROUND + spacing * levels)
+
+def bench_tiles():
+    report("Tile objects (list of lists)", measure(build_object_tiles))
+    report("TileGrid", measure(build_tiles))
+
+def bench_paths(repeat = 20):
+    tiles = build_tiles()
+    goal = dig_galleries(tiles)
+    circulation = FacilityPath(tiles)
+    def callback_path():
+        path = libtcod.path_new_using_function(MAP_WIDTH, MAP_HEIGHT,
+                                            walk_compute, tiles, 1.41)
+        libtcod.path_compute(path, 0, GROUND, goal[0], goal[1])
+        libtcod.path_delete(path)
+    def map_path():
+        circulation.compute_path(0, GROUND, goal[0], goal[1])
+    def cached_path():
+        circulation.path_from_to(0, GROUND, goal[0], goal[1])
+    report("A* with walk_compute callback", measure(callback_path, repeat))
+    report("A* with libtcod map", measure(map_path, repeat))
+    report("Cached route", measure(cached_path, repeat))
+    hierarchy = FacilityPath(tiles, HierarchicalPaths)
+    def hierarchical_path():
+        hierarchy.compute_path(0, GROUND, goal[0], goal[1])
+    def dig_in_chunk():
+        # Alternate between closing and opening the same tile
+        tiles.set_solid(100, GROUND + 12, tiles.is_solid(100, GROUND + 12) == 0)
+    report("HPA* (16x16 chunks)", measure(hierarchical_path, repeat))
+    report("HPA* chunk rebuild after a dig", measure(dig_in_chunk, repeat))
+    if numpy is not None:
+        wavefront = FacilityPath(tiles, NumpyPathEngine)
+        def numpy_path():
+            wavefront.compute_path(0, GROUND, goal[0], goal[1])
+        report("NumPy wavefront", measure(numpy_path, repeat))
+    jumps = FacilityPath(tiles, JumpPointPathEngine)
+    def jps_path():
+        jumps.compute_path(0, GROUND, goal[0], goal[1])
+    report("Jump Point Search", measure(jps_path, repeat))
+
+def bench_open_cavern(repeat = 20):
+    """A wide cavern dotted with pillars, crossed from corner to corner."""
+    tiles = build_tiles()
+    for y in range(GROUND + 1, MAP_HEIGHT - 1):
+        for x in range(1, MAP_WIDTH - 1):
+            tiles.set_solid(x, y, x % 20 == 10 and y % 15 == 5)
+    libtcod_paths = FacilityPath(tiles)
+    jumps = FacilityPath(tiles, JumpPointPathEngine)
+    def libtcod_path():
+        libtcod_paths.compute_path(1, GROUND, MAP_WIDTH - 2, MAP_HEIGHT - 2)
+    def jps_path():
+        jumps.compute_path(1, GROUND, MAP_WIDTH - 2, MAP_HEIGHT - 2)
+    report("Open cavern, libtcod A*", measure(libtcod_path, repeat))
+    report("Open cavern, Jump Point Search", measure(jps_path, repeat))
+
+def bench_flow_field(workers = 50, repeat = 5):
+    """Send workers spread on the surface to a dig front at the bottom of
+    the galleries : one A* each, against one shared flow field."""
+    tiles = build_tiles()
+    goal = dig_galleries(tiles)
+    circulation = FacilityPath(tiles)
+    targets = [(x, goal[1] + 1) for x in range(1, 40)]
+    origins = [(x * MAP_WIDTH // workers, GROUND) for x in range(workers)]
+    def astar_each():
+        for origin in origins:
+            circulation.compute_path(origin[0], origin[1], goal[0], goal[1])
+    def shared_field():
+        field = FlowField(tiles, targets)
+        field.build()
+    report("%d workers, one A* each" % workers, measure(astar_each, repeat))
+    report("%d workers, shared flow field" % workers,
+            measure(shared_field, repeat))
+
+def bench_batched_paths(workers = 200, threads = 4):
+    """The tick in which many idle workers all take a task."""
+    def build(path_threads):
+        facility = SecureFacility(build_tiles(), path_threads = path_threads)
+        goal = dig_galleries(facility.tiles)
+        for i in range(workers):
+            facility.add_employee(EmployeeType.WORKER,
+                                    (i * MAP_WIDTH // workers, GROUND))
+            # One dig under each gallery, far enough not to share a field
+            level = i % 8
+            facility.add_dig((3 + (i // 8) * 12, GROUND + 6 * (level + 1) + 1))
+        return facility
+    for path_threads in (0, threads):
+        facility = build(path_threads)
+        start = time.time()
+        facility.update_employees()
+        elapsed = (time.time() - start) * 1000
+        facility.circulation.close()
+        report("%d workers take a task, %d threads" % (workers, path_threads),
+                (elapsed, None))
+
+def bench_extract(employees = 2000, digs = 10000, repeat = 20):
+    """What the map view asks for every frame, in a large facility."""
+    facility = SecureFacility(build_tiles())
+    for i in range(employees):
+        facility.add_employee(EmployeeType.WORKER,
+                            (i * 7 % MAP_WIDTH, GROUND + i % 100))
+    for i in range(digs):
+        facility.add_dig((i % MAP_WIDTH, GROUND + 1 + i // MAP_WIDTH))
+    window = (100, 20, 180, 70)
+    def scan():
+        return ([employee for employee in facility.employees
+                    if employee.location.isIn(*window)],
+                [task for task in facility.todoList
+                    if task.location.isIn(*window)])
+    def index():
+        return (facility.extract_employees_in(*window),
+                facility.extract_tasks_in(*window))
+    report("Visible window, scanning the lists",
+            (measure(scan, repeat)[0], None))
+    report("Visible window, spatial index", (measure(index, repeat)[0], None))
+
+def bench_task_store(workers = 200, digs = 5000, repeat = 5):
+    """Busy workers looking for a task on every tick, and a whole queue
+    of digs being taken then finished. Flow fields and swaps take tasks
+    anywhere in the queue : here, the newest first."""
+    facility = SecureFacility(build_tiles())
+    for i in range(digs):
+        facility.add_dig((i % MAP_WIDTH, GROUND + 1 + i // MAP_WIDTH))
+    tasks = list(facility.todoList)
+    newest_first = tasks[::-1]
+    def filtered_lists():
+        for i in range(workers):
+            [task for task in tasks if task.taskType in
+                Task.employeesTasksType[EmployeeType.WORKER]]
+    def peek():
+        for i in range(workers):
+            facility.peek_task_for(EmployeeType.WORKER)
+    def lists_take_finish():
+        todo = list(tasks)
+        being_done = []
+        for task in newest_first:
+            todo.remove(task)
+            being_done.append(task)
+        for task in tasks:
+            being_done.remove(task)
+    def store_take_finish():
+        todo = TaskStore()
+        being_done = TaskStore()
+        for task in tasks:
+            todo.add(task)
+        for task in newest_first:
+            todo.remove(task)
+            being_done.add(task)
+        for task in tasks:
+            being_done.remove(task)
+    report("%d lookups, filtered lists" % workers,
+            measure(filtered_lists, repeat))
+    report("%d lookups, task store" % workers, measure(peek, repeat))
+    report("%d tasks taken then done, lists" % digs,
+            measure(lists_take_finish, repeat))
+    report("%d tasks queued, taken, done, store" % digs,
+            measure(store_take_finish, repeat))
+
+def bench_assignment(workers = 100):
+    """Idle workers spread on the surface, digs spread in a grid of
+    galleries and shafts.
+    Workers used to take the first queued task ; now the facility pairs
+    them with the closest ones."""
+    def build():
+        facility = SecureFacility(build_tiles())
+        dig_galleries(facility.tiles)
+        # Shafts every 40 tiles, so that paths go roughly straight
+        for x in range(20, MAP_WIDTH, 40):
+            for y in range(GROUND + 1, GROUND + 6 * 8):
+                facility.tiles.set_solid(x, y, False)
+        for i in range(workers):
+            facility.add_employee(EmployeeType.WORKER,
+                                (i * MAP_WIDTH // workers, GROUND))
+        for i in range(workers):
+            # Scattered, in an order unrelated to where workers are
+            x = 3 + (i * 37) % (MAP_WIDTH - 6)
+            facility.add_dig((x, GROUND + 6 * (i % 8 + 1) + 1))
+        return facility
+    def travel(facility):
+        return sum(len(employee.behaviour.currentPath)
+                    for employee in facility.employees
+                    if employee.behaviour.currentPath is not None)
+    facility = build()
+    start = time.time()
+    for employee in facility.employees:
+        task = facility.peek_task_for(employee.employeeType)
+        if task is not None:
+            employee.behaviour.take_task(task, facility)
+    for behaviour, steps in facility.circulation.resolve_requests():
+        behaviour.path_found(steps, facility)
+    report("First queued task, %d steps to walk" % travel(facility),
+            ((time.time() - start) * 1000, None))
+    facility = build()
+    start = time.time()
+    facility.assign_tasks()
+    for behaviour, steps in facility.circulation.resolve_requests():
+        behaviour.path_found(steps, facility)
+    report("Closest task, %d steps to walk" % travel(facility),
+            ((time.time() - start) * 1000, None))
+    report("  of which assignment", (facility.assignment['ms'], None))
+
+def bench_dig_area(width = 100, height = 50, repeat = 10):
+    """A large drag in dig mode, from the messenger to the queued tasks :
+    one message per tile, or one for all."""
+    area = (10, GROUND + 1, 10 + width - 1, GROUND + height)
+    tile_messages = [Message(Message.DIG, (x, y))
+                        for x in range(area[0], area[2] + 1)
+                        for y in range(area[1], area[3] + 1)]
+    area_messages = [Message(Message.DIG, area)]
+    def best_time(messages):
+        best = None
+        for i in range(repeat):
+            facility = SecureFacility(build_tiles())
+            messenger = Messenger()
+            start = time.time()
+            for message in messages:
+                messenger.receive(message)
+            messenger.poll_events(facility)
+            elapsed = (time.time() - start) * 1000
+            if best is None or elapsed < best:
+                best = elapsed
+        return best, len(facility.queuedDigs)
+    label = "%dx%d drag, %s, %d tasks"
+    elapsed, tasks = best_time(tile_messages)
+    report(label % (width, height, "per tile", tasks), (elapsed, None))
+    elapsed, tasks = best_time(area_messages)
+    report(label % (width, height, "area", tasks), (elapsed, None))
+    elapsed, tasks = best_time(area_messages * 2)
+    report(label % (width, height, "area twice", tasks), (elapsed, None))
+
+def bench_parking(workers = 50, pockets = 200, ticks = 20):
+    """Idle workers and digs in sealed pockets. Releasing the whole lot
+    before each tick gives back the former behaviour, where they were
+    tried again and again."""
+    def build():
+        facility = SecureFacility(build_tiles())
+        for i in range(workers):
+            facility.add_employee(EmployeeType.WORKER,
+                                (i * MAP_WIDTH // workers, GROUND))
+        for i in range(pockets):
+            x = 2 + (i * 3) % (MAP_WIDTH - 4)
+            y = GROUND + 10 + 4 * ((i * 3) // (MAP_WIDTH - 4))
+            facility.tiles.set_solid(x, y, False)
+            facility.add_dig((x + 1, y))
+        return facility
+    for parked in (False, True):
+        facility = build()
+        start = time.time()
+        for tick in range(ticks):
+            if not parked:
+                for task in facility.parking.release_all():
+                    facility.todoList.add(task)
+                    facility.todoIndex.add(task)
+            facility.update_employees()
+        label = "%d ticks, %s" % (ticks, "parked" if parked else "retried")
+        report(label, ((time.time() - start) * 1000, None))
+    print("  %s" % facility.parking.stats())
+
+def bench_priority_queue(tasks = 50000, takes = 5000, repeat = 3):
+    """Taking the next task out of a large queue, some of it urgent."""
+    def take_all():
+        store = TaskStore()
+        for i in range(tasks):
+            store.add(Task(Message.DIG, (i % MAP_WIDTH, i // MAP_WIDTH),
+                            1 if i % 100 == 0 else 0))
+        start = time.time()
+        for i in range(takes):
+            store.remove(store.peek([Message.DIG]))
+        return (time.time() - start) * 1000
+    best = min(take_all() for i in range(repeat))
+    report("%d takes out of %d tasks" % (takes, tasks), (best, None))
+
+def dig_block(facility):
+    """A large block right under the surface."""
+    facility.add_dig_area(110, GROUND + 1, 209, GROUND + 30)
+
+def dig_from_shaft(facility):
+    """A large block, only reachable from a shaft along its side."""
+    for y in range(GROUND + 1, GROUND + 41):
+        facility.tiles.set_solid(109, y, False)
+    facility.add_dig_area(110, GROUND + 11, 209, GROUND + 40)
+
+def dig_pits(facility):
+    """Small pits under a gallery, too small to get a flow field."""
+    for x in range(1, MAP_WIDTH - 1):
+        facility.tiles.set_solid(x, GROUND + 5, False)
+    for y in range(GROUND + 1, GROUND + 5):
+        facility.tiles.set_solid(MAP_WIDTH // 2, y, False)
+    for x in range(10, MAP_WIDTH - 10, 8):
+        facility.add_dig_area(x, GROUND + 6, x + 2, GROUND + 9)
+
+def timed(owner, name, spent):
+    """Replace a method of owner by one adding its time (in ms) to
+    spent[0]."""
+    method = getattr(owner, name)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            spent[0] = spent[0] + (time.time() - start) * 1000
+    setattr(owner, name, wrapper)
+
+def bench_excavation(workers = 20, minutes = 2, repeat = 3):
+    """Tiles dug per simulated minute (120 ticks of 500 ms). Putting the
+    buried digs in the queue gives back the former scheduling, where any
+    queued dig could be handed out. Most of a tick goes to the dig flow
+    fields, whatever the scheduling : the scheduling itself (looking for
+    the closest dig, and releasing buried digs as tiles open) is timed
+    apart. Best of several runs."""
+    ticks = 120 * minutes
+    for layout in (dig_block, dig_from_shaft, dig_pits):
+        for frontier in (False, True):
+            best = None
+            scheduling = None
+            for run in range(repeat):
+                # Idle workers wander at random
+                facility = SecureFacility(build_tiles(), seed = 0)
+                for i in range(workers):
+                    facility.add_employee(EmployeeType.WORKER,
+                                        (i * MAP_WIDTH // workers, GROUND))
+                layout(facility)
+                queued = len(facility.queuedDigs)
+                if not frontier:
+                    for task in facility.buried.release_all():
+                        facility.todoList.add(task)
+                        facility.todoIndex.add(task)
+                spent = [0]
+                timed(facility.todoIndex, 'nearest', spent)
+                timed(facility.parking, 'tile_opened', spent)
+                timed(facility.buried, 'tile_opened', spent)
+                start = time.time()
+                for tick in range(ticks):
+                    facility.update_employees()
+                elapsed = (time.time() - start) * 1000
+                if best is None or elapsed < best:
+                    best = elapsed
+                if scheduling is None or spent[0] < scheduling:
+                    scheduling = spent[0]
+            dug = queued - len(facility.queuedDigs) \
+                    - len(facility.ongoingDigs)
+            label = "%s, %s : %d dug/min" % (layout.__name__,
+                    "frontier" if frontier else "queue", dug // minutes)
+            report(label, (best, None))
+            report("  of which scheduling", (scheduling, None))
+
+def bench_wake_ups(employees = 300, ticks = 240):
+    """Employees only act when their wake-up is due : standing still
+    between two wander decisions, or digging until the tile opens."""
+    for digging in (False, True):
+        facility = SecureFacility(build_tiles(), seed = 0)
+        for i in range(employees):
+            facility.add_employee(EmployeeType.WORKER,
+                                (1 + i * (MAP_WIDTH - 2) // employees, GROUND))
+        if digging:
+            # Hard rock right under everyone : long digs, no walk
+            for x in range(1, MAP_WIDTH - 1):
+                facility.tiles.set_resistance(x, GROUND + 1, 250)
+            facility.add_dig_area(1, GROUND + 1, MAP_WIDTH - 2, GROUND + 1)
+        awake = 0
+        start = time.time()
+        for tick in range(ticks):
+            facility.update_employees()
+            awake = awake + facility.awake
+        elapsed = (time.time() - start) * 1000
+        label = "%s, %.1f%% awake per tick" % (
+                    "digging" if digging else "idle",
+                    100.0 * awake / (ticks * employees))
+        report(label, (elapsed, None))
+
+def bench_employee_store(employees = 10000, ticks = 60,
+                        crowds = (32, 64, 128, 512, 2048, 10000)):
+    """Wandering crowd : a tick moves all the walkers at once, with NumPy,
+    or one by one. Moving is a small part of a tick : the move itself is
+    measured too, for crowds of several sizes."""
+    tiles = build_tiles()
+    rng = random.Random(0)
+    for crowd in crowds:
+        results = []
+        for minimum in (0, crowd + 1):
+            store = EmployeeStore()
+            store.VECTOR_MINIMUM = minimum
+            for i in range(crowd):
+                store.add(rng.randrange(1, MAP_WIDTH - 1), GROUND,
+                        EmployeeType.WORKER)
+                store.dirX[i] = rng.choice((-1, 1))
+            indexes = list(range(crowd))
+            results.append(measure(lambda: store.move(indexes, tiles), 30))
+        report("move %d walkers, vectorized" % crowd, results[0])
+        report("move %d walkers, one by one" % crowd, results[1])
+    for minimum in (EmployeeStore.VECTOR_MINIMUM, employees + 1):
+        facility = SecureFacility(build_tiles(), seed = 0)
+        facility.employeeStore.VECTOR_MINIMUM = minimum
+        for i in range(employees):
+            facility.add_employee(EmployeeType.WORKER,
+                                (1 + i * (MAP_WIDTH - 2) // employees, GROUND))
+        start = time.time()
+        for tick in range(ticks):
+            facility.update_employees()
+        elapsed = (time.time() - start) * 1000
+        label = "%d employees, %s, per tick" % (employees,
+                    "one by one" if minimum > employees else "vectorized")
+        report(label, (elapsed / ticks, None))
+
+def bench_path_processes(searches = 400, processes = (0, 1, 2, 4, 8)):
+    """A tick full of searches through deep galleries, with the pure
+    Python JPS engine, computed by the facility and 0 to 8 processes.
+    The facility starts at most one process per spare core : when it
+    started fewer, the processes asked are also forced, to show what
+    they would cost here. With a core each, a tick would wait for the
+    largest band, plus the transfers : the bands are timed one by one
+    in the facility to project it. Only a projection : measure it on
+    as many cores before trusting it."""
+    rng = random.Random(0)
+    tiles = build_tiles()
+    dig_galleries(tiles)
+    keys = [(rng.randrange(1, MAP_WIDTH - 1), GROUND,
+            rng.randrange(1, MAP_WIDTH - 1), GROUND + 6 * rng.randrange(1, 9))
+            for search in range(searches)]
+    def run(circulation):
+        if circulation.processes is not None:
+            # Wait for the processes to build their engine
+            circulation.processes.compute([], circulation.compute_path)
+        start = time.time()
+        for key in keys:
+            circulation.request_path(None, *key)
+        circulation.resolve_requests()
+        elapsed = (time.time() - start) * 1000
+        started = 0
+        if circulation.processes is not None:
+            started = len(circulation.processes.workers)
+        circulation.close()
+        return elapsed, started
+    for count in processes:
+        elapsed, started = run(FacilityPath(tiles, JumpPointPathEngine,
+                                            processes = count))
+        report("%d searches, %d processes (%d started)"
+                % (searches, count, started), (elapsed, None))
+        if started < count:
+            circulation = FacilityPath(tiles, JumpPointPathEngine)
+            circulation.processes = PathProcesses(tiles, JumpPointPathEngine,
+                                                count)
+            forced = run(circulation)[0]
+            report("%d searches, %d processes forced" % (searches, count),
+                    (forced, None))
+            engine = JumpPointPathEngine(tiles)
+            times = []
+            for band in depth_bands(keys, count + 1):
+                start = time.time()
+                for key in band:
+                    engine.path(*key)
+                times.append((time.time() - start) * 1000)
+            engine.close()
+            report("  projected on %d cores" % (count + 1),
+                    (max(times) + forced - sum(times), None))
+
+def bench_save_load(employees = 2000, ticks = 20):
+    """A full map with thousands of employees, after some digging : built
+    again by replaying the orders and the ticks, or loaded from a save."""
+    def replay():
+        facility = SecureFacility(build_tiles(), seed = 0)
+        for i in range(employees):
+            facility.add_employee(EmployeeType.WORKER, (i % MAP_WIDTH, GROUND))
+        facility.add_dig_area(10, GROUND + 1, MAP_WIDTH - 10, GROUND + 40)
+        for tick in range(ticks):
+            facility.update_employees()
+        return facility
+    start = time.time()
+    facility = replay()
+    report("replay orders and %d ticks" % ticks,
+            ((time.time() - start) * 1000, None))
+    filename = 'bench.sav'
+    report("save", measure(lambda: savegame.save(facility, filename)))
+    # Memory allocated by the loaded facility : not its tiles
+    report("load a %d KB save" % (os.path.getsize(filename) // 1024),
+            measure(lambda: savegame.load(filename)))
+    os.remove(filename)
+
+def bench_autosave(employees = 200, ticks = 100, period = 10):
+    """Ticks of a digging crowd, with and without the autosave : what it
+    costs the game thread is the snapshots, taken between ticks."""
+    def run(autosave):
+        facility = SecureFacility(build_tiles(), seed = 0)
+        for i in range(employees):
+            facility.add_employee(EmployeeType.WORKER, (i % MAP_WIDTH, GROUND))
+        facility.add_dig_area(10, GROUND + 1, MAP_WIDTH - 10, GROUND + 8)
+        saving = None
+        if autosave:
+            saving = savegame.Autosave(facility, filename, period)
+        durations = []
+        for tick in range(ticks):
+            start = time.time()
+            facility.update_employees()
+            if saving is not None:
+                saving.update()
+            durations.append((time.time() - start) * 1000)
+        if saving is not None:
+            saving.close()
+        return facility, durations, saving
+    filename = 'bench.sav'
+    try:
+        facility, durations, saving = run(False)
+        report("tick, no autosave (mean)",
+                (sum(durations) / len(durations), None))
+        report("tick, no autosave (longest)", (max(durations), None))
+        facility, durations, saving = run(True)
+        report("tick, autosave (mean)",
+                (sum(durations) / len(durations), None))
+        report("tick, autosave (longest)", (max(durations), None))
+        report("first snapshot, of the full save", (saving.first, None))
+        report("snapshot, %d taken (mean)" % saving.snapshots,
+                (saving.total / saving.snapshots, None))
+        report("snapshot (longest)", (saving.longest, None))
+        print("%d KB of journal, %d compactions" % (saving.written // 1024,
+                                                    saving.compactions))
+        report("full save, for comparison",
+                measure(lambda: savegame.save(facility, filename)))
+    finally:
+        for name in (filename, savegame.journal_of(filename)):
+            if os.path.exists(name):
+                os.remove(name)
+
+if __name__ == "__main__":
+    bench_tiles()
+    bench_paths()
+    bench_open_cavern()
+    bench_flow_field()
+    bench_batched_paths()
+    bench_extract()
+    bench_task_store()
+    bench_assignment()
+    bench_dig_area()
+    bench_parking()
+    bench_priority_queue()
+    bench_excavation()
+    bench_wake_ups()
+    bench_employee_store()
+    bench_path_processes()
+    bench_save_load()
+    bench_autosave()
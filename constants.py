@@ -3,6 +3,8 @@ WIDTH = 80
 HEIGHT = 60
 MAP_WIDTH = WIDTH * 4
 MAP_HEIGHT = HEIGHT * 3
+# Simulated time of a tick, in ms
+TICK_LENGTH = 500
 
 class EmployeeType:
     WORKER = 0
@@ -1,46 +1,356 @@
 """This module contains gameplay classes connected
 to the facility the player has to manage."""
 
-from constants import GROUND, MAP_WIDTH, MAP_HEIGHT, EmployeeType
+import time
+from array import array
+from collections import OrderedDict
+from multiprocessing import Pipe, Process, cpu_count
+from random import Random
+from heapq import heapify, heappush, heappop
+
+from constants import GROUND, MAP_WIDTH, MAP_HEIGHT, TICK_LENGTH, EmployeeType
 from messaging import Message
 from ai import EmployeeBehaviour
-import libtcodpy as libtcod
+from pathing import PathCache, FlowField, Components, default_engine, \
+        octile
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport : paths are computed serially
+    ThreadPoolExecutor = None
+
+try:
+    import numpy
+except ImportError:
+    # Employees are moved one by one
+    numpy = None
 
 
 def walk_compute(xFrom, yFrom, xTo, yTo, user_data):
     """This function is used for pathfinding. It will need to be
     imrpoved to allow diagonal move ONLY for stairway patterns."""
-    if user_data[xTo][yTo].solid:
+    if user_data.is_solid(xTo, yTo):
         return 0
     else:
         return 1
 
+class TileGrid(object):
+    """The tiles of a complex, stored as flat byte arrays indexed by
+    y * width + x instead of one object per tile. The depth of a tile
+    is its row, so it is not stored.
+    grid[x][y] still gives a Tile, for code that wants a tile object.
+    The arrays may be given, as any writable buffer of bytes : a loaded
+    facility gives memory-mapped ones."""
+    RESISTANCE = 5
+    # Rows of a chunk : a chunk is contiguous in the arrays
+    CHUNK_ROWS = 8
+
+    def __init__(self, width, height, solid = None, resistance = None):
+        self.width = width
+        self.height = height
+        size = width * height
+        if resistance is None:
+            resistance = bytearray([TileGrid.RESISTANCE]) * size
+        self.resistance = resistance
+        if solid is None:
+            # Everything under the ground level is solid rock
+            surface = min(GROUND + 1, height) * width
+            solid = bytearray(surface) + bytearray([1]) * (size - surface)
+        self.solid = solid
+        self.columns = [TileColumn(self, x) for x in range(width)]
+        # Objects told when the solidity of a tile changes
+        self.observers = []
+        # Chunks written to, when someone wants to know (autosave)
+        self.changedChunks = None
+
+    def __getitem__(self, x):
+        return self.columns[x]
+
+    def __len__(self):
+        return self.width
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def is_solid(self, x, y):
+        return self.solid[y * self.width + x] != 0
+
+    def set_solid(self, x, y, solid):
+        index = y * self.width + x
+        if (self.solid[index] != 0) != solid:
+            self.solid[index] = 1 if solid else 0
+            self.chunk_changed(y)
+            self.solidity_changed(x, y, solid)
+
+    def open_tiles_in(self, x1, y1, x2, y2):
+        """The open tiles of a rectangle, looked for a row at a time."""
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width - 1), min(y2, self.height - 1)
+        tiles = []
+        for y in range(y1, y2 + 1):
+            start = y * self.width
+            row = bytes(self.solid[start + x1:start + x2 + 1])
+            x = row.find(b'\0')
+            while x >= 0:
+                tiles.append((x1 + x, y))
+                x = row.find(b'\0', x + 1)
+        return tiles
+
+    def get_resistance(self, x, y):
+        return self.resistance[y * self.width + x]
+
+    def set_resistance(self, x, y, resistance):
+        self.resistance[y * self.width + x] = resistance
+        self.chunk_changed(y)
+
+    def dig(self, x, y, strokes = 1):
+        """Lower the resistance of a tile, opening it when it reaches 0."""
+        index = y * self.width + x
+        resistance = self.resistance[index]
+        if resistance > 0:
+            resistance = max(0, resistance - strokes)
+            self.resistance[index] = resistance
+            self.chunk_changed(y)
+            if resistance == 0 and self.solid[index]:
+                self.solid[index] = 0
+                self.solidity_changed(x, y, False)
+
+    def chunk_changed(self, y):
+        if self.changedChunks is not None:
+            self.changedChunks.add(y // TileGrid.CHUNK_ROWS)
+
+    def add_observer(self, observer):
+        """Observers must provide a solidity_changed(x, y, solid) method."""
+        self.observers.append(observer)
+
+    def solidity_changed(self, x, y, solid):
+        for observer in self.observers:
+            observer.solidity_changed(x, y, solid)
+
+class TileColumn(object):
+    """A column of a TileGrid, so that grid[x][y] keeps working."""
+    __slots__ = ('grid', 'x')
+
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.x = x
+
+    def __getitem__(self, y):
+        return Tile(self.grid, self.x, y)
+
+    def __len__(self):
+        return self.grid.height
+
 class Tile(object):
-    def __init__(self, depth):
-        self.depth = depth
-        self.solid = self.depth > GROUND
-        self.resistance = 5
+    """A lightweight view on one tile of a TileGrid."""
+    __slots__ = ('grid', 'x', 'y')
+
+    def __init__(self, grid, x, y):
+        self.grid = grid
+        self.x = x
+        self.y = y
+
+    @property
+    def depth(self):
+        return self.y
 
-    def dig(self):
-        self.resistance = self.resistance - 1
-        if self.resistance == 0:
-            self.solid = False
+    @property
+    def solid(self):
+        return self.grid.is_solid(self.x, self.y)
+
+    @solid.setter
+    def solid(self, solid):
+        self.grid.set_solid(self.x, self.y, solid)
+
+    @property
+    def resistance(self):
+        return self.grid.get_resistance(self.x, self.y)
+
+    @resistance.setter
+    def resistance(self, resistance):
+        self.grid.set_resistance(self.x, self.y, resistance)
+
+    def dig(self, strokes = 1):
+        self.grid.dig(self.x, self.y, strokes)
 
 class FacilityPath(object):
-    def __init__(self, tiles):
+    # Smaller dig regions are cheaper to reach with a plain A*
+    FLOW_FIELD_MINIMUM = 16
+    # Fewer searches cost less than sending them to the path processes
+    PROCESS_MINIMUM = 8
+
+    def __init__(self, tiles, engine = None, threads = 0, processes = 0):
         self.tiles = tiles
+        if engine is None:
+            engine = default_engine()
+        self.engine = engine(tiles)
+        self.cache = PathCache()
+        # Paths asked during the current tick
+        self.requests = []
+        # The libtcod engine releases the GIL while computing a path
+        self.pool = None
+        if threads > 0 and ThreadPoolExecutor is not None:
+            self.pool = ThreadPoolExecutor(max_workers = threads)
+        # The other engines need processes to use more than one core. The
+        # facility computes its share too : more processes than cores left
+        # would only add transfers
+        self.processes = None
+        processes = min(processes, spare_cores())
+        if processes > 0:
+            self.processes = PathProcesses(tiles, engine, processes)
+        self.components = Components(tiles)
+        # Flow fields of the dig regions, and the region of each dig target
+        self.fields = []
+        self.regions = {}
+        self.tiles.add_observer(self)
+
+    def solidity_changed(self, x, y, solid):
+        """Keep the engine and the flow fields in sync with the tiles."""
+        self.engine.solidity_changed(x, y, solid)
+        if self.processes is not None:
+            self.processes.solidity_changed(x, y, solid)
+        self.cache.invalidate()
+        if solid:
+            self.components.tile_closed(x, y)
+        else:
+            self.components.tile_opened(x, y)
+        for field in self.fields:
+            if solid:
+                field.tile_closed(x, y)
+            else:
+                field.tile_opened(x, y)
+
+    def add_dig_target(self, x, y):
+        """Add a tile waiting to be dug to its dig region, merging the
+        regions it touches."""
+        touched = []
+        for tile in self.surrounding_tiles_of(x, y):
+            field = self.regions.get(tile)
+            if field is not None and field not in touched:
+                touched.append(field)
+        if len(touched) == 0:
+            field = FlowField(self.tiles)
+            self.fields.append(field)
+        else:
+            field = max(touched, key = lambda f: len(f.targets))
+            for other in touched:
+                if other is not field:
+                    field.merge(other)
+                    for target in other.targets:
+                        self.regions[target] = field
+                    self.fields.remove(other)
+        self.regions[(x, y)] = field
+        field.add_target(x, y)
+
+    def add_dig_targets(self, targets):
+        """Add many tiles waiting to be dug at once, as one region with
+        the regions they touch. Meant for areas : the tiles of an area
+        are together anyway, so there is no need to merge them one by
+        one."""
+        if len(targets) == 0:
+            return
+        targets = set(targets)
+        touched = []
+        for x, y in targets:
+            for tile in self.surrounding_tiles_of(x, y):
+                field = self.regions.get(tile)
+                if field is not None and field not in touched:
+                    touched.append(field)
+        field = FlowField(self.tiles, targets)
+        for other in touched:
+            field.merge(other)
+            for target in other.targets:
+                self.regions[target] = field
+            self.fields.remove(other)
+        self.fields.append(field)
+        for target in targets:
+            self.regions[target] = field
+
+    def add_dig_regions(self, regions):
+        """Add dig regions known to be apart from each other and from the
+        regions there are, as a save gives them : one flow field each,
+        with no region to merge."""
+        for targets in regions:
+            field = FlowField(self.tiles, targets)
+            self.fields.append(field)
+            for target in targets:
+                self.regions[target] = field
+
+    def remove_dig_target(self, x, y):
+        field = self.regions.pop((x, y), None)
+        if field is not None:
+            field.remove_target(x, y)
+            if len(field.targets) == 0:
+                self.fields.remove(field)
+
+    def flow_field_for(self, x, y):
+        """Serve the flow field of the region of a dig target, if this
+        region is large enough to be worth it."""
+        field = self.regions.get((x, y))
+        if field is not None and len(field.targets) >= self.FLOW_FIELD_MINIMUM:
+            return field
+        return None
 
     def path_from_to(self, ox, oy, dx, dy):
-        path = libtcod.path_new_using_function(MAP_WIDTH,
-                                        MAP_HEIGHT,
-                                        walk_compute,
-                                        self.tiles,
-                                        1.41)
-        libtcod.path_compute(path, ox, oy, dx, dy)
-        return path
+        """Return the steps from origin to destination, as a tuple of
+        coordinates. The tuple is empty if there is no path."""
+        steps = self.cache.get(ox, oy, dx, dy)
+        if steps is None:
+            steps = self.compute_path(ox, oy, dx, dy)
+            self.cache.put(ox, oy, dx, dy, steps)
+        return steps
+
+    def request_path(self, requester, ox, oy, dx, dy):
+        """Queue a path search, to be resolved with the others of the
+        tick by resolve_requests."""
+        self.requests.append((requester, (ox, oy, dx, dy)))
+
+    def resolve_requests(self):
+        """Compute all the queued paths, on the path processes or the
+        thread pool if there are some. Serve (requester, steps) couples,
+        in the order of requests."""
+        requests = self.requests
+        self.requests = []
+        results = {}
+        missing = []
+        for requester, key in requests:
+            if key not in results:
+                results[key] = self.cache.get(*key)
+                if results[key] is None:
+                    missing.append(key)
+        if self.processes is not None \
+                and len(missing) >= self.PROCESS_MINIMUM:
+            computed = self.processes.compute(missing, self.compute_path)
+        elif self.pool is not None and len(missing) > 1:
+            computed = self.pool.map(lambda key: self.compute_path(*key),
+                                    missing)
+        else:
+            computed = [self.compute_path(*key) for key in missing]
+        for key, steps in zip(missing, computed):
+            self.cache.put(key[0], key[1], key[2], key[3], steps)
+            results[key] = steps
+        return [(requester, results[key]) for requester, key in requests]
+
+    def close(self):
+        """Free the native resources. Paths cannot be computed anymore."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.processes is not None:
+            self.processes.close()
+            self.processes = None
+        self.engine.close()
+
+    def compute_path(self, ox, oy, dx, dy):
+        return self.engine.path(ox, oy, dx, dy)
+
+    def is_reachable(self, ox, oy, dx, dy):
+        """Tell in constant time if a path exists between two tiles."""
+        return self.components.connected(ox, oy, dx, dy)
 
     def is_movement_possible(self, x,y):
-        return self.is_tile_in_map(x,y) and not self.tiles[x][y].solid
+        return self.is_tile_in_map(x,y) and not self.tiles.is_solid(x,y)
 
     def is_tile_in_map(self, x,y):
         return x >= 0 and y >= 0 and x < MAP_WIDTH and y < MAP_HEIGHT
@@ -55,9 +365,6 @@ class FacilityPath(object):
             self.is_movement_possible(tile[0], tile[1])]
 
 class Elevator(object):
-    representation = [[libtcod.CHAR_NW,libtcod.CHAR_HLINE, libtcod.CHAR_NE]
-                     ,[libtcod.CHAR_VLINE, ord(' '), libtcod.CHAR_VLINE]
-                     ,[libtcod.CHAR_SW, libtcod.CHAR_HLINE, libtcod.CHAR_SE]]
     def __init__(self, location):
         self.location = location
         self.floors = [location.getY()]
@@ -125,15 +432,167 @@ class Elevator(object):
         else:
             return 1 # Note : means we go down if equality
 
+def spare_cores():
+    """The cores left once the facility has one."""
+    try:
+        return cpu_count() - 1
+    except NotImplementedError:
+        return 0
+
+class PathProcesses(object):
+    """Path searches spread over worker processes. Only the searches are :
+    the simulation itself stays in the facility, which owns every
+    employee and task, so there are no shards to hand employees over
+    between, nor halos to keep. Each process has a whole replica of the
+    tiles and its own engine. Tile changes are sent to all of them before
+    the next searches, so the replicas see the tiles the facility engine
+    sees, and find the same paths. The searches of a tick are cut in
+    depth bands of as many searches each, one for the facility and one
+    per process : a process gets searches starting close to each other."""
+    # Tile changes waiting for the next searches, at most
+    CHANGES_MAXIMUM = 256
+
+    def __init__(self, tiles, engine, processes):
+        self.changes = []
+        self.connections = []
+        self.workers = []
+        for band in range(processes):
+            connection, theirs = Pipe()
+            worker = Process(target = serve_paths,
+                            args = (theirs, engine, tiles.width,
+                                    tiles.height, bytes(tiles.solid)))
+            worker.daemon = True
+            worker.start()
+            theirs.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def solidity_changed(self, x, y, solid):
+        self.changes.append((x, y, solid))
+        if len(self.changes) >= self.CHANGES_MAXIMUM:
+            self.send_changes()
+
+    def send_changes(self):
+        """Send the tile changes on their own : nothing comes back."""
+        for connection in self.connections:
+            connection.send((self.changes, None))
+        self.changes = []
+
+    def compute(self, keys, compute_path):
+        """Serve the steps of each (ox, oy, dx, dy) search, in order. The
+        first band is computed here, by compute_path."""
+        bands = depth_bands(keys, len(self.connections) + 1)
+        changes = self.changes
+        self.changes = []
+        # Everybody works at the same time, then we collect
+        for connection, band in zip(self.connections, bands[1:]):
+            connection.send((changes, band))
+        results = {}
+        for key in bands[0]:
+            results[key] = compute_path(*key)
+        for connection, band in zip(self.connections, bands[1:]):
+            for key, flat in zip(band, connection.recv()):
+                results[key] = tuple(zip(flat[0::2], flat[1::2]))
+        return [results[key] for key in keys]
+
+    def close(self):
+        """Stop the processes and wait for them, even those already
+        dead."""
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                # Its process is gone : nothing to stop
+                pass
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+
+def depth_bands(keys, count):
+    """Cut (ox, oy, dx, dy) searches in count bands of as many searches
+    each, by depth of origin."""
+    ordered = sorted(keys, key = lambda key: (key[1], key[0]))
+    return [ordered[len(ordered) * band // count:
+                    len(ordered) * (band + 1) // count]
+            for band in range(count)]
+
+def serve_paths(connection, engine, width, height, solid):
+    """What a path process does : apply the tile changes it is sent, then
+    compute the searches that came with them, if any."""
+    tiles = TileGrid(width, height)
+    tiles.solid[:] = solid
+    paths = engine(tiles)
+    tiles.add_observer(paths)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        changes, keys = message
+        for x, y, solid in changes:
+            tiles.set_solid(x, y, solid)
+        if keys is None:
+            continue
+        # Flat arrays of coordinates are much cheaper to send than tuples
+        connection.send([array('i', [c for step in paths.path(*key)
+                                        for c in step])
+                        for key in keys])
+    paths.close()
+    connection.close()
+
 class SecureFacility(object):
-    def __init__(self, tiles):
+    # Ticks run at most by one update, when catching up with a slow frame
+    MAX_CATCH_UP = 5
+
+    def __init__(self, tiles, engine = None, path_threads = 0,
+                tick_length = TICK_LENGTH, seed = None, path_processes = 0):
         self.objects = [] # A dict of coord tuple and array of objects
         self.tiles = tiles
         self.employees = []
-        self.todoList = []
-        self.beingDoneList = []
-        self.circulation = FacilityPath(self.tiles)
-        self.tick = 0
+        # Employees only act when they have something to do
+        self.wakeUps = Scheduler()
+        # Task ages are counted on the same clock
+        self.todoList = TaskStore(self.wakeUps)
+        self.beingDoneList = TaskStore(self.wakeUps)
+        # Dig tasks waiting for an employee, by coordinates
+        self.queuedDigs = {}
+        # Dig tasks being done, by coordinates
+        self.ongoingDigs = {}
+        # Where things are, so that a view does not scan every list
+        self.employeesIndex = SpatialIndex()
+        self.todoIndex = SpatialIndex()
+        self.beingDoneIndex = SpatialIndex()
+        self.circulation = FacilityPath(self.tiles, engine, path_threads,
+                                        path_processes)
+        # Tasks nobody can reach, until a dig opens a way
+        self.parking = ParkingLot(self.circulation)
+        # Digs with no open tile next to them, until one opens : only the
+        # frontier of the rock to dig is handed out
+        self.buried = ParkingLot(self.circulation)
+        # After the circulation, so that components are up to date
+        self.tiles.add_observer(self)
+        # Simulated time of a tick, and real time not simulated yet (ms)
+        self.tickLength = tick_length
+        self.accumulator = 0
+        self.ticks = 0
+        # Real time given up because the simulation could not keep up
+        self.droppedTime = 0
+        # What the last assignment of tasks did, and what it cost
+        self.assignment = {'idle' : 0, 'assigned' : 0,
+                            'distance' : 0, 'ms' : 0}
+        # Positions, directions, types and states of the employees
+        self.employeeStore = EmployeeStore()
+        self.idleEmployees = set()
+        # Employees who acted during the last tick
+        self.awake = 0
+        # Every random decision comes from here : same seed and same
+        # orders, same simulation
+        self.random = Random(seed)
+        # Draws made for the current tick
+        self.draws = []
+        # Task -> where it went since the last autosave, if autosaved
+        self.taskChanges = None
 
     def add_object_on(self, x, y, obj):
         self.objects.append(obj)
@@ -141,54 +600,315 @@ class SecureFacility(object):
     def command(self, message):
         if message.complement() is not None:
             if message.getVerb() == Message.DIG:
-                self.add_dig(message.complement())
+                complement = message.complement()
+                if len(complement) == 4:
+                    self.add_dig_area(*complement, priority = message.priority)
+                else:
+                    self.add_dig(complement, message.priority)
             elif message.getVerb() == Message.RECRUIT:
-                self.add_employee(message.complement())
+                employeeType = message.complement()
+                # Typed orders name the type instead of giving its number
+                if isinstance(employeeType, str):
+                    employeeType = getattr(EmployeeType, employeeType, None)
+                if employeeType is not None:
+                    self.add_employee(employeeType)
 
-    def add_employee(self, employeeType):
-        employee = Employee(employeeType)
+    def add_employee(self, employeeType, location = (0, GROUND)):
+        employee = Employee(employeeType, location, self.employeeStore)
         self.employees.append(employee)
+        self.employeesIndex.add(employee)
+        self.idleEmployees.add(employee)
+        self.wakeUps.schedule(employee)
+
+    def add_dig(self, location, priority = 0):
+        if self.queue_dig(location[0], location[1], priority):
+            self.circulation.add_dig_target(location[0], location[1])
+
+    def add_dig_area(self, x1, y1, x2, y2, priority = 0):
+        """Dig a whole rectangle. Serve the number of digs queued."""
+        x1, x2 = max(min(x1, x2), 0), min(max(x1, x2), self.tiles.width - 1)
+        y1, y2 = max(min(y1, y2), 0), min(max(y1, y2), self.tiles.height - 1)
+        # Tiles next to an open one, found from the few open tiles rather
+        # than by looking around every tile of the area
+        frontier = set()
+        for x, y in self.tiles.open_tiles_in(x1 - 1, y1 - 1, x2 + 1, y2 + 1):
+            frontier.update(self.circulation.surrounding_tiles_of(x, y))
+        queued = [(x, y) for y in range(y1, y2 + 1)
+                        for x in range(x1, x2 + 1)
+                        if self.queue_dig(x, y, priority, (x, y) in frontier)]
+        self.circulation.add_dig_targets(queued)
+        return len(queued)
+
+    def queue_dig(self, x, y, priority = 0, frontier = None):
+        """Queue a dig task, unless there is nothing to dig or the tile
+        is already in the works. Serve True if the task was queued.
+        frontier tells if the tile is next to an open one, when known."""
+        # Cannot dig above ground, nor out of the map !
+        if y < 4 or not self.circulation.is_tile_in_map(x, y) \
+                or not self.tiles.is_solid(x, y):
+            return False
+        location = (x, y)
+        if location in self.queuedDigs or location in self.ongoingDigs:
+            return False
+        task = Task(Message.DIG, location, priority)
+        self.queuedDigs[location] = task
+        if frontier is None:
+            frontier = len(self.circulation.free_surrounding_tiles_of(x, y)) > 0
+        if frontier:
+            self.todoList.add(task)
+            self.todoIndex.add(task)
+            self.task_changed(task, Task.QUEUED)
+        else:
+            # Keep its age for when it reaches the frontier
+            self.todoList.stamp(task)
+            self.buried.park(task, set())
+            self.task_changed(task, Task.BURIED)
+        return True
 
-    def add_dig(self, location):
-        # Cannot dig above ground !
-        if location[1] >= 4:
-            self.todoList.append(Task(Message.DIG, location))
+    def task_changed(self, task, status):
+        """Tell the autosave, if any, where a task is now. Tasks being
+        done are saved queued."""
+        if self.taskChanges is not None:
+            self.taskChanges[task] = status
 
     def extract_employees_in(self, x1, y1, x2, y2):
-        return self.extract_location(x1,y1,x2,y2, self.employees)
+        return self.employeesIndex.extract_location(x1, y1, x2, y2)
 
     def extract_tasks_in(self, x1, y1, x2, y2):
-        return self.extract_location(x1,y1,x2,y2, self.todoList)
+        return self.todoIndex.extract_location(x1, y1, x2, y2) \
+                + self.parking.index.extract_location(x1, y1, x2, y2) \
+                + self.buried.index.extract_location(x1, y1, x2, y2)
 
     def extract_ongoing_tasks_in(self, x1, y1, x2, y2):
-        return self.extract_location(x1,y1,x2,y2, self.beingDoneList)
-
-    def extract_location(self, x1, y1, x2, y2, array):
-        return [item for item in array
-                if item.location.isIn(x1,y1,x2,y2)]
+        return self.beingDoneIndex.extract_location(x1, y1, x2, y2)
 
     def consume_task(self, task):
+        if task in self.parking:
+            # A parked dig, taken by someone who happens to stand next to it
+            self.parking.unpark(task)
+            self.task_changed(task, Task.QUEUED)
+        elif task in self.buried:
+            self.buried.unpark(task)
+            self.task_changed(task, Task.QUEUED)
+        else:
+            self.todoList.remove(task)
+            self.todoIndex.remove(task)
+        self.beingDoneList.add(task)
+        self.beingDoneIndex.add(task)
+        if task.taskType == Message.DIG:
+            location = (task.location.x, task.location.y)
+            self.ongoingDigs[location] = task
+            if self.queuedDigs.get(location) is task:
+                del self.queuedDigs[location]
+                self.circulation.remove_dig_target(location[0], location[1])
+
+    def release_task(self, task):
+        """Put back a task taken by an employee who will not do it."""
+        self.beingDoneList.remove(task)
+        self.beingDoneIndex.remove(task)
+        self.todoList.add(task)
+        self.todoIndex.add(task)
+        if task.taskType == Message.DIG:
+            location = (task.location.x, task.location.y)
+            self.ongoingDigs.pop(location, None)
+            if location not in self.queuedDigs:
+                self.queuedDigs[location] = task
+                self.circulation.add_dig_target(location[0], location[1])
+
+    def give_up_task(self, task):
+        """Called by an employee who cannot reach a task. Park the task,
+        unless someone else able to do it may reach it : then put it
+        back in the queue."""
+        if task in self.beingDoneList:
+            self.release_task(task)
+        regions = self.parking.regions_around(task)
+        components = self.circulation.components
+        for employee in self.employees:
+            if task.taskType in Task.employeesTasksType[employee.employeeType]\
+                    and components.component(employee.location.x,
+                                            employee.location.y) in regions:
+                return
         self.todoList.remove(task)
-        self.beingDoneList.append(task)
+        self.todoIndex.remove(task)
+        self.parking.park(task, regions)
+        self.task_changed(task, Task.PARKED)
+
+    def solidity_changed(self, x, y, solid):
+        """Tiles observer : put back in the queue the parked tasks that
+        may be reachable now."""
+        if solid:
+            released = self.parking.release_all()
+        else:
+            released = self.parking.tile_opened(x, y) \
+                        + self.buried.tile_opened(x, y)
+        for task in released:
+            self.todoList.add(task)
+            self.todoIndex.add(task)
+            self.task_changed(task, Task.QUEUED)
+
+    def dig_next_to(self, x, y):
+        """Serve a queued dig task next to (x,y), if there is one."""
+        for tile in self.circulation.surrounding_tiles_of(x, y):
+            task = self.queuedDigs.get(tile)
+            if task is not None:
+                return task
+        return None
+
+    def take_dig_next_to(self, x, y):
+        """Consume a queued dig task next to (x,y), if there is one."""
+        task = self.dig_next_to(x, y)
+        if task is not None:
+            self.consume_task(task)
+        return task
 
     def done(self, task):
         self.beingDoneList.remove(task)
+        self.beingDoneIndex.remove(task)
+        self.task_changed(task, Task.DONE)
+        if task.taskType == Message.DIG:
+            self.ongoingDigs.pop((task.location.x, task.location.y), None)
 
-    def get_task_for_type(self, employeeType):
-        tasks_searched = Task.employeesTasksType[employeeType]
-        return [task for task in self.todoList
-                    if task.taskType in tasks_searched]
+    def peek_task_for(self, employeeType):
+        """The first queued task an employee of this type can do, or None.
+        The task stays queued until consumed."""
+        return self.todoList.peek(Task.employeesTasksType[employeeType])
 
-    def update(self, time):
-        self.tick += time
-        if self.tick > 500:
-            self.tick = 0
+    def update(self, elapsed):
+        """Simulate elapsed ms of real time, in ticks of fixed length, so
+        that the simulation speed does not depend on the frame rate.
+        Time left over is kept for the next call. After a slow frame,
+        at most MAX_CATCH_UP ticks are run : if ticks cost more than the
+        time they simulate, catching up would only make the next frame
+        slower, so the rest of the backlog is dropped.
+        Serve the number of ticks run."""
+        self.accumulator = self.accumulator + elapsed
+        steps = 0
+        while self.accumulator >= self.tickLength \
+                and steps < self.MAX_CATCH_UP:
             self.update_employees()
+            self.accumulator = self.accumulator - self.tickLength
+            steps = steps + 1
+        if self.accumulator >= self.tickLength:
+            backlog = self.accumulator - self.accumulator % self.tickLength
+            self.droppedTime = self.droppedTime + backlog
+            self.accumulator = self.accumulator - backlog
+        self.ticks = self.ticks + steps
+        return steps
+
+    def assign_tasks(self):
+        """Give queued tasks to idle employees. Tasks due first (urgent
+        ones, or ones that waited long enough) are given in queue order,
+        each to the closest idle employee able to do it.
+        Then closest pairs first : every idle employee asks the index for
+        its closest task ; when two want the same task, the closest one
+        gets it and the other asks again."""
+        start = time.time()
+        idle = len(self.idleEmployees)
+        if idle > 0:
+            # Without the parking lot, these would have been tried again
+            self.parking.avoided = self.parking.avoided + len(self.parking)
+        tried = set()
+        assigned, distance = self.assign_due_tasks(tried)
+        candidates = []
+        if self.todoList:
+            for employee in self.idleEmployees:
+                if employee.behaviour.is_idle() and employee not in tried:
+                    self.push_candidate(candidates, employee.location.index)
+        while candidates:
+            task_distance, number, task = heappop(candidates)
+            if task not in self.todoList:
+                # Taken by someone closer
+                self.push_candidate(candidates, number)
+                continue
+            self.give_task(self.employees[number], task)
+            assigned = assigned + 1
+            distance = distance + task_distance
+        self.assignment = {'idle' : idle, 'assigned' : assigned,
+                            'distance' : distance,
+                            'ms' : (time.time() - start) * 1000}
+
+    def assign_due_tasks(self, tried):
+        """Serve the number of tasks assigned, and the distance to them.
+        Employees who were given a task are added to tried."""
+        due = self.wakeUps.now - TaskStore.AGING
+        assigned = 0
+        distance = 0
+        taskTypes = list(self.todoList.queues)
+        task = self.todoList.peek(taskTypes)
+        while task is not None and task.key <= due:
+            employee, task_distance = self.employeesIndex.nearest(
+                                task.location.x, task.location.y,
+                                lambda employee: employee not in tried
+                                    and employee.behaviour.is_idle()
+                                    and task.taskType in Task.employeesTasksType
+                                                    [employee.employeeType])
+            if employee is None:
+                # Nobody left for this task, nor for the next ones of its
+                # type : skip them, other types may still be served
+                taskTypes.remove(task.taskType)
+            else:
+                tried.add(employee)
+                self.give_task(employee, task)
+                assigned = assigned + 1
+                distance = distance + task_distance
+            task = self.todoList.peek(taskTypes)
+        return assigned, distance
+
+    def give_task(self, employee, task):
+        """Hand a task to an idle employee, who acts during this tick."""
+        self.idleEmployees.discard(employee)
+        self.wakeUps.schedule(employee)
+        employee.behaviour.take_task(task, self)
+
+    def push_candidate(self, candidates, number):
+        employee = self.employees[number]
+        taskTypes = Task.employeesTasksType[employee.employeeType]
+        if not taskTypes:
+            return
+        task, distance = self.todoIndex.nearest(employee.location.x,
+                                employee.location.y,
+                                lambda task: task.taskType in taskTypes)
+        if task is not None:
+            heappush(candidates, (distance, number, task))
 
     def update_employees(self):
-        for employee in self.employees:
+        """Run a tick. Only the employees whose wake-up is due act : each
+        then tells when it has to act again."""
+        self.assign_tasks()
+        awake = self.wakeUps.due()
+        # A wanderer needs a draw to decide, and one more if it stops
+        wanderers = len([employee for employee in awake
+                        if employee.behaviour.is_idle()])
+        random = self.random.random
+        self.draws = [random() for draw in range(2 * wanderers)]
+        for employee in awake:
             employee.behaviour.update(self)
-            employee.location.update(self)
+        # Paths asked during the tick are computed in one batch
+        for behaviour, steps in self.circulation.resolve_requests():
+            behaviour.path_found(steps, self)
+        # Everybody walking takes a step at once
+        store = self.employeeStore
+        for number in store.move([employee.location.index
+                                  for employee in awake], self.tiles):
+            self.employeesIndex.move(self.employees[number])
+        for employee in awake:
+            self.wakeUps.schedule(employee,
+                                employee.behaviour.next_update(self))
+            store.state[employee.location.index] = employee.behaviour.behaviour
+            if employee.behaviour.is_idle():
+                self.idleEmployees.add(employee)
+            else:
+                self.idleEmployees.discard(employee)
+        self.awake = len(awake)
+        self.draws = []
+        self.wakeUps.tick()
+
+    def draw(self):
+        """A random number in [0, 1). Those of a tick are drawn at once,
+        at its beginning."""
+        if self.draws:
+            return self.draws.pop()
+        return self.random.random()
 
 class Position(object):
     """A simple container to provide cartesian coordinates."""
@@ -221,11 +941,140 @@ class Location(Position):
         self.dirY = y
 
     def update(self, facility):
+        """Move along the directional vector if possible. Tell if the
+        location changed."""
         nextX = self.x + self.dirX
         nextY = self.y + self.dirY
-        if facility.circulation.is_movement_possible(nextX, nextY):
+        if (nextX != self.x or nextY != self.y) \
+                and facility.circulation.is_movement_possible(nextX, nextY):
             self.x = nextX
             self.y = nextY
+            return True
+        return False
+
+class StoredLocation(Location):
+    """The location of an employee, kept in an EmployeeStore."""
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        # Through the properties : a new location stands still where the
+        # store puts it
+        super(StoredLocation, self).__init__(store.x[index], store.y[index])
+
+    @property
+    def x(self):
+        return self.store.x[self.index]
+
+    @x.setter
+    def x(self, x):
+        self.store.x[self.index] = x
+
+    @property
+    def y(self):
+        return self.store.y[self.index]
+
+    @y.setter
+    def y(self, y):
+        self.store.y[self.index] = y
+
+    @property
+    def dirX(self):
+        return self.store.dirX[self.index]
+
+    @dirX.setter
+    def dirX(self, dirX):
+        self.store.dirX[self.index] = dirX
+
+    @property
+    def dirY(self):
+        return self.store.dirY[self.index]
+
+    @dirY.setter
+    def dirY(self, dirY):
+        self.store.dirY[self.index] = dirY
+
+    def update(self, facility):
+        return self.store.move_one(self.index, facility.tiles)
+
+class EmployeeStore(object):
+    """The employees data, in parallel arrays rather than in an object
+    per employee : position, direction, type and behaviour state.
+    These are typed arrays, so that reading one employee is cheap ; with
+    NumPy, moving many employees is a single vectorized step, on views of
+    the same memory. States are those at the end of the last tick."""
+    COLUMNS = ('x', 'y', 'dirX', 'dirY', 'employeeType', 'state')
+    # Fewer walkers are moved one by one : NumPy only pays off from about
+    # 64 of them, and is twice as fast from 128
+    VECTOR_MINIMUM = 128
+
+    def __init__(self):
+        for column in self.COLUMNS:
+            setattr(self, column, array('i'))
+        # Column -> NumPy view, made when needed
+        self.views = None
+
+    def add(self, x, y, employeeType, state = EmployeeBehaviour.WANDER):
+        """Serve the index of the new employee."""
+        # Arrays cannot grow while viewed
+        self.views = None
+        values = (x, y, 0, 0, employeeType, state)
+        for column, value in zip(self.COLUMNS, values):
+            getattr(self, column).append(value)
+        return len(self.x) - 1
+
+    def vectors(self):
+        if self.views is None:
+            self.views = dict((column, numpy.frombuffer(getattr(self, column),
+                                                        dtype = numpy.intc))
+                                for column in self.COLUMNS)
+        return self.views
+
+    def move_one(self, index, tiles):
+        """Move an employee along its direction, if the tiles let it.
+        Tell if it moved."""
+        nextX = self.x[index] + self.dirX[index]
+        nextY = self.y[index] + self.dirY[index]
+        if (nextX != self.x[index] or nextY != self.y[index]) \
+                and 0 <= nextX < tiles.width and 0 <= nextY < tiles.height \
+                and not tiles.is_solid(nextX, nextY):
+            self.x[index] = nextX
+            self.y[index] = nextY
+            return True
+        return False
+
+    def move(self, indexes, tiles):
+        """Move the given employees along their direction, where the tiles
+        let them. Serve the indexes of those who moved, in order."""
+        if numpy is None or len(indexes) < self.VECTOR_MINIMUM:
+            return [index for index in indexes if self.move_one(index, tiles)]
+        views = self.vectors()
+        indexes = numpy.array(indexes, dtype = numpy.intp)
+        dirX = views['dirX'][indexes]
+        dirY = views['dirY'][indexes]
+        walking = (dirX != 0) | (dirY != 0)
+        indexes = indexes[walking]
+        nextX = views['x'][indexes] + dirX[walking]
+        nextY = views['y'][indexes] + dirY[walking]
+        inside = (nextX >= 0) & (nextY >= 0) \
+                & (nextX < tiles.width) & (nextY < tiles.height)
+        indexes = indexes[inside]
+        nextX = nextX[inside]
+        nextY = nextY[inside]
+        solid = numpy.frombuffer(tiles.solid, dtype = numpy.uint8)
+        free = solid[nextY * tiles.width + nextX] == 0
+        indexes = indexes[free]
+        views['x'][indexes] = nextX[free]
+        views['y'][indexes] = nextY[free]
+        return indexes.tolist()
+
+    def count(self, column, value):
+        """How many employees have this value in the column."""
+        if numpy is None:
+            return getattr(self, column).count(value)
+        return int(numpy.count_nonzero(self.vectors()[column] == value))
+
+    def __len__(self):
+        return len(self.x)
 
 class Rectangle(Position):
     def __init__(self, x, y, x2, y2):
@@ -233,28 +1082,397 @@ class Rectangle(Position):
         self.x2 = x2
         self.y2 = y2
 
+class SpatialIndex(object):
+    """Things with a location, bucketed in square cells of a uniform
+    grid. Looking for what is in a rectangle only reads the cells it
+    overlaps, so it costs what the rectangle holds, not what the whole
+    facility holds. Things that move must be moved in the index too."""
+    CELL = 16
+
+    def __init__(self):
+        # Cell coordinates -> OrderedDict whose keys are the things in it
+        self.cells = {}
+        # Thing -> its cell coordinates
+        self.cell_of = {}
+
+    def key(self, location):
+        return (location.x // self.CELL, location.y // self.CELL)
+
+    def add(self, item):
+        key = self.key(item.location)
+        self.cell_of[item] = key
+        self.cells.setdefault(key, OrderedDict())[item] = None
+
+    def add_all(self, items):
+        cells = self.cells
+        cell_of = self.cell_of
+        size = self.CELL
+        for item in items:
+            key = (item.location.x // size, item.location.y // size)
+            cell_of[item] = key
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = OrderedDict()
+            cell[item] = None
+
+    def remove(self, item):
+        key = self.cell_of.pop(item)
+        cell = self.cells[key]
+        del cell[item]
+        if not cell:
+            del self.cells[key]
+
+    def move(self, item):
+        """Update the cell of an item whose location changed."""
+        if self.cell_of.get(item) != self.key(item.location):
+            self.remove(item)
+            self.add(item)
+
+    def __len__(self):
+        return len(self.cell_of)
+
+    def extract_location(self, x1, y1, x2, y2):
+        found = []
+        for cx in range(x1 // self.CELL, x2 // self.CELL + 1):
+            for cy in range(y1 // self.CELL, y2 // self.CELL + 1):
+                for item in self.cells.get((cx, cy), ()):
+                    if item.location.isIn(x1, y1, x2, y2):
+                        found.append(item)
+        return found
+
+    def ring(self, cx, cy, radius):
+        """The cells at a given distance of the cell (cx,cy)."""
+        if radius == 0:
+            return [(cx, cy)]
+        cells = []
+        for cx2 in range(cx - radius, cx + radius + 1):
+            cells.append((cx2, cy - radius))
+            cells.append((cx2, cy + radius))
+        for cy2 in range(cy - radius + 1, cy + radius):
+            cells.append((cx - radius, cy2))
+            cells.append((cx + radius, cy2))
+        return cells
+
+    def nearest(self, x, y, accept):
+        """The closest thing to (x,y) that accept() likes, and its octile
+        distance ; or (None, None). Cells are read ring by ring : the
+        things beyond ring r are more than r * CELL tiles away, so we
+        can stop as soon as what we found is closer."""
+        cx = x // self.CELL
+        cy = y // self.CELL
+        best = None
+        best_distance = None
+        seen = 0
+        radius = 0
+        while seen < len(self.cell_of):
+            for key in self.ring(cx, cy, radius):
+                cell = self.cells.get(key)
+                if cell is None:
+                    continue
+                seen = seen + len(cell)
+                for item in cell:
+                    if not accept(item):
+                        continue
+                    distance = octile((x, y), (item.location.x,
+                                                item.location.y))
+                    if best is None or distance < best_distance:
+                        best = item
+                        best_distance = distance
+            if best is not None and best_distance <= radius * self.CELL + 1:
+                break
+            radius = radius + 1
+        return best, best_distance
+
 class Employee(object):
-    def __init__(self, employeeType):
+    def __init__(self, employeeType, location = (0, GROUND), store = None):
         self.employeeType = employeeType
-        self.location = Location(0,GROUND)
+        if store is None:
+            self.location = Location(location[0], location[1])
+        else:
+            self.location = StoredLocation(store, store.add(location[0],
+                                                location[1], employeeType))
         self.behaviour = EmployeeBehaviour(self.location, self.employeeType)
 
+class TaskStore(object):
+    """Tasks, queued by type. Each type is a heap ordered by task key :
+    the tick the task was queued at, minus AGING ticks per priority
+    level. An urgent task gets ahead of the tasks queued during the last
+    AGING * priority ticks, but not of older ones : waiting long enough
+    always brings a task first, however many tasks are queued after it.
+    Tasks with the same key keep the order they were stamped in.
+    Removed tasks are left in the heaps, and skipped when they come up,
+    so that adding, removing and peeking stay O(log n)."""
+    # A minute, at the default tick length
+    AGING = 120
+
+    def __init__(self, clock = None):
+        # Something with a now attribute, in ticks : time stands still
+        # without one
+        self.clock = clock
+        # Task type -> heap of [key, order, count, task] ; task is None
+        # once removed
+        self.queues = {}
+        self.entries = {}
+        # Tasks stamped, and entries added
+        self.sequence = 0
+        self.count = 0
+        self.removed = 0
+
+    def now(self):
+        if self.clock is None:
+            return 0
+        return self.clock.now
+
+    def stamp(self, task):
+        """Give its key to a new task. Tasks put back in the queue keep
+        their key, hence their age."""
+        if task.key is None:
+            task.key = self.now() - self.AGING * task.priority
+        if task.order is None:
+            self.sequence = self.sequence + 1
+            task.order = self.sequence
+
+    def add(self, task):
+        self.stamp(task)
+        self.count = self.count + 1
+        entry = [task.key, task.order, self.count, task]
+        self.entries[task] = entry
+        heappush(self.queues.setdefault(task.taskType, []), entry)
+
+    def add_all(self, tasks):
+        """Add many tasks, with a heap built once per type."""
+        touched = set()
+        for task in tasks:
+            self.stamp(task)
+            self.count = self.count + 1
+            entry = [task.key, task.order, self.count, task]
+            self.entries[task] = entry
+            self.queues.setdefault(task.taskType, []).append(entry)
+            touched.add(task.taskType)
+        for taskType in touched:
+            heapify(self.queues[taskType])
+
+    def remove(self, task):
+        self.entries.pop(task)[-1] = None
+        self.removed = self.removed + 1
+        if self.removed > len(self.entries) + 64:
+            self.compact()
+
+    def compact(self):
+        for taskType, queue in self.queues.items():
+            queue = [entry for entry in queue if entry[-1] is not None]
+            heapify(queue)
+            self.queues[taskType] = queue
+        self.removed = 0
+
+    def head(self, taskType):
+        queue = self.queues.get(taskType)
+        while queue and queue[0][-1] is None:
+            heappop(queue)
+            self.removed = self.removed - 1
+        if queue:
+            return queue[0]
+        return None
+
+    def peek(self, taskTypes):
+        """The first task of one of the given types, or None."""
+        best = None
+        for taskType in taskTypes:
+            entry = self.head(taskType)
+            if entry is not None and (best is None or entry < best):
+                best = entry
+        if best is None:
+            return None
+        return best[-1]
+
+    def __contains__(self, task):
+        return task in self.entries
+
+    def __iter__(self):
+        """The tasks, in queue order."""
+        for entry in sorted(self.entries.values()):
+            yield entry[-1]
+
+    def __len__(self):
+        return len(self.entries)
+
+class Scheduler(object):
+    """Wake-up times, in ticks, of things that only act now and then.
+    A heap of wake-ups : serving the things due costs what they are, not
+    what is waiting. A thing has one wake-up at most ; scheduling it
+    again replaces the previous one, left in the heap and skipped.
+    Things due at the same tick are served in the order they were first
+    scheduled."""
+    def __init__(self):
+        self.now = 0
+        # Heap of [tick, rank, count, thing] ; thing is None once replaced
+        self.heap = []
+        self.entries = {}
+        self.ranks = {}
+        self.count = 0
+
+    def schedule(self, thing, delay = 0):
+        """Wake thing up in delay ticks ; 0 is the current tick, if the
+        things due have not been served yet."""
+        self.cancel(thing)
+        rank = self.ranks.setdefault(thing, len(self.ranks))
+        self.count = self.count + 1
+        entry = [self.now + delay, rank, self.count, thing]
+        self.entries[thing] = entry
+        heappush(self.heap, entry)
+
+    def cancel(self, thing):
+        entry = self.entries.pop(thing, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def wake_up_of(self, thing):
+        """The tick thing is due at, or None."""
+        entry = self.entries.get(thing)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def due(self):
+        """Take out the things due, in wake-up order."""
+        things = []
+        while self.heap and self.heap[0][0] <= self.now:
+            thing = heappop(self.heap)[-1]
+            if thing is not None:
+                del self.entries[thing]
+                things.append(thing)
+        return things
+
+    def tick(self):
+        self.now = self.now + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+class ParkingLot(object):
+    """Tasks put aside, typically because nobody can reach them. A parked
+    task waits on the regions (components of open tiles) next to it : it
+    is only worth trying again when a dig opens a tile bordering one of
+    them, or a tile next to the task itself."""
+    def __init__(self, circulation):
+        self.circulation = circulation
+        # Task -> the roots of the components it waits on
+        self.tasks = OrderedDict()
+        # Component root -> OrderedDict whose keys are the tasks waiting
+        self.regions = {}
+        self.index = SpatialIndex()
+        # Tile -> the tasks on it : a dig only has to look at the 9 tiles
+        # around it, not at whole index cells
+        self.tiles = {}
+        self.parked = 0
+        self.released = 0
+        # One per parked task and per tick with idle employees
+        self.avoided = 0
+
+    def regions_around(self, task):
+        components = self.circulation.components
+        return set(components.component(x, y) for x, y in
+                    self.circulation.free_surrounding_tiles_of(
+                        task.location.x, task.location.y))
+
+    def park(self, task, regions):
+        self.tasks[task] = regions
+        for region in regions:
+            self.regions.setdefault(region, OrderedDict())[task] = None
+        self.index.add(task)
+        tile = (task.location.x, task.location.y)
+        self.tiles.setdefault(tile, []).append(task)
+        self.parked = self.parked + 1
+
+    def park_all(self, tasks):
+        """Park tasks that wait on no region, like buried digs."""
+        waiting = self.tasks
+        tiles = self.tiles
+        for task in tasks:
+            waiting[task] = ()
+            tiles.setdefault((task.location.x, task.location.y),
+                            []).append(task)
+        self.index.add_all(tasks)
+        self.parked = self.parked + len(tasks)
+
+    def unpark(self, task):
+        for region in self.tasks.pop(task):
+            waiting = self.regions[region]
+            del waiting[task]
+            if not waiting:
+                del self.regions[region]
+        self.index.remove(task)
+        tile = (task.location.x, task.location.y)
+        waiting = self.tiles[tile]
+        waiting.remove(task)
+        if not waiting:
+            del self.tiles[tile]
+
+    def tile_opened(self, x, y):
+        """Unpark and serve the tasks next to (x,y), and the tasks waiting
+        on a region the tile has just joined."""
+        released = OrderedDict()
+        for y2 in (y - 1, y, y + 1):
+            for x2 in (x - 1, x, x + 1):
+                for task in self.tiles.get((x2, y2), ()):
+                    released[task] = None
+        if self.regions:
+            components = self.circulation.components
+            joined = components.component(x, y)
+            for region in list(self.regions):
+                if components.find(region) == joined:
+                    released.update(self.regions[region])
+        return self.release(list(released))
+
+    def release_all(self):
+        return self.release(list(self.tasks))
+
+    def release(self, tasks):
+        for task in tasks:
+            self.unpark(task)
+        self.released = self.released + len(tasks)
+        return tasks
+
+    def stats(self):
+        return {'parked' : self.parked,
+                'released' : self.released,
+                'avoided' : self.avoided,
+                'waiting' : len(self.tasks)}
+
+    def __contains__(self, task):
+        return task in self.tasks
+
+    def __len__(self):
+        return len(self.tasks)
+
 class Task(object):
+    # Where a task is, as far as saving is concerned
+    QUEUED = 0
+    BURIED = 1
+    PARKED = 2
+    DONE = 3
+
     employeesTasksType = { EmployeeType.WORKER : [Message.DIG],
                             EmployeeType.SECURITY : [],
                             EmployeeType.RESEARCH : [] }
 
-    def __init__(self, taskType, location):
+    def __init__(self, taskType, location, priority = 0):
         self.taskType = taskType
         self.location = Location(location[0], location[1])
+        # The higher, the sooner
+        self.priority = priority
+        # Queue order, given when first queued : age and priority, then
+        # order of arrival
+        self.key = None
+        self.order = None
 
-def buildFacility():
-    """Build a new complex."""
-    return SecureFacility(build_tiles())
+def buildFacility(engine = None, path_threads = 0, tick_length = TICK_LENGTH,
+                seed = None, path_processes = 0):
+    """Build a new complex. The path engine is a PathEngine class."""
+    return SecureFacility(build_tiles(), engine, path_threads, tick_length,
+                        seed, path_processes)
 
 def build_tiles():
-    """Return the tile matrix for a new complex."""
-    return [[ Tile(y)
-                for y in range(MAP_HEIGHT) ]
-                for x in range(MAP_WIDTH) ]
+    """Return the tile grid for a new complex."""
+    return TileGrid(MAP_WIDTH, MAP_HEIGHT)
 
@@ -1,6 +1,10 @@
 """This module components handle events around SecFac."""
 
-import libtcodpy as libtcod
+try:
+    import libtcodpy as libtcod
+except OSError:
+    # Headless : no libtcod shared library, hence no input devices
+    libtcod = None
 
 class Focusable(object):
     def __init__(self):
@@ -38,6 +42,8 @@ class Message(object):
     PUT = "PUT"
     DIG = "DIG"
     TILE = "TILE"
+    AREA = "AREA"
+    PRIORITY = "PRIORITY"
     BUILD = "BUILD"
     DISPLAY = "DISPLAY"
     RECRUIT = "RECRUIT"
@@ -48,6 +54,8 @@ class Message(object):
 
     def __init__(self, verb, complement = None):
         self.verb = verb
+        # Orders may be more urgent than others
+        self.priority = 0
         self.complements = []
         if complement is not None:
             self.complements.append(complement)
@@ -75,8 +83,9 @@ class Messenger(object):
         self.must_clean = False
         # Flag for mouse left button drag
         self.current_lclick = False
-        self.mouse = libtcod.Mouse()
-        self.key = libtcod.Key()
+        if libtcod is not None:
+            self.mouse = libtcod.Mouse()
+            self.key = libtcod.Key()
         # Last position shall be cached here since libtcod is somewhat buggy
         # there
         self.lastX = 0
@@ -166,6 +175,12 @@ def message_parser(text):
     message = Message(verb)
     sentence = words[1:]
     while len(sentence) > 0:
+        if sentence[0] == Message.PRIORITY:
+            if len(sentence) < 2 or not sentence[1].lstrip('-').isdigit():
+                return Message(Message.DISPLAY, "Priority must be a number !")
+            message.priority = int(sentence[1])
+            sentence = sentence[2:]
+            continue
         sentence, complement = parseComplement(sentence)
         if complement is None:
             return Message(Message.DISPLAY, "String is not parsable !")
@@ -181,7 +196,7 @@ def parseVerb(word):
 def parseComplement(complement):
     index = 1
     element = None
-    if complement[0] == Message.TILE:
+    if complement[0] in (Message.TILE, Message.AREA):
         coords = complement[1].split(',')
         coords = map(int,coords)
         element = (tuple(coords))
@@ -0,0 +1,932 @@
+"""This module contains the pathfinding helpers used by the facility
+circulation, and the path engines it can be built with."""
+
+from array import array
+from collections import OrderedDict
+from heapq import heapify, heappush, heappop
+from threading import Lock
+
+try:
+    import libtcodpy as libtcod
+except OSError:
+    # No libtcod shared library : only the other engines can be used
+    libtcod = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DIAGONAL_COST = 1.41
+INFINITY = float('inf')
+
+class Route(object):
+    """A computed path, followed one step at a time."""
+    def __init__(self, steps):
+        self.steps = steps
+        self.index = 0
+
+    def walk(self):
+        """Serve the next step, or (None, None) once the route is over."""
+        if self.index >= len(self.steps):
+            return None, None
+        step = self.steps[self.index]
+        self.index = self.index + 1
+        return step
+
+    def __len__(self):
+        return len(self.steps) - self.index
+
+class PathCache(object):
+    """A LRU cache of routes, as tuples of steps, keyed by origin and
+    destination. Each entry remembers the generation it was computed in :
+    any change of solidity starts a new generation, and older entries are
+    then considered as misses."""
+    def __init__(self, capacity = 512):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def invalidate(self):
+        self.generation = self.generation + 1
+
+    def get(self, ox, oy, dx, dy):
+        """Serve the cached steps, or None if there is no valid entry."""
+        entry = self.entries.pop((ox, oy, dx, dy), None)
+        if entry is None or entry[0] != self.generation:
+            self.misses = self.misses + 1
+            return None
+        # Put it back as the most recently used
+        self.entries[(ox, oy, dx, dy)] = entry
+        self.hits = self.hits + 1
+        return entry[1]
+
+    def put(self, ox, oy, dx, dy, steps):
+        self.entries.pop((ox, oy, dx, dy), None)
+        self.entries[(ox, oy, dx, dy)] = (self.generation, steps)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last = False)
+            self.evictions = self.evictions + 1
+
+    def stats(self):
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions,
+                'size' : len(self.entries),
+                'generation' : self.generation}
+
+class Components(object):
+    """A union-find of the open tiles, connected through the 8 directions.
+    Digging only ever opens tiles, so components only need to be merged,
+    and asking whether two tiles are connected is almost constant time."""
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.build()
+
+    def build(self):
+        width = self.tiles.width
+        height = self.tiles.height
+        # -1 for solid tiles, the parent index for open ones
+        self.parents = array('i', [-1]) * (width * height)
+        self.sizes = {}
+        parents = self.parents
+        # Row by row : only the neighbours before a tile are open already
+        for x, y in self.tiles.open_tiles_in(0, 0, width - 1, height - 1):
+            index = y * width + x
+            parents[index] = index
+            self.sizes[index] = 1
+            if x > 0 and parents[index - 1] != -1:
+                self.union(index, index - 1)
+            if y > 0:
+                above = index - width
+                for neighbour in (above - 1, above, above + 1):
+                    if neighbour >= (y - 1) * width and neighbour < y * width \
+                            and parents[neighbour] != -1:
+                        self.union(index, neighbour)
+
+    def find(self, index):
+        parents = self.parents
+        root = index
+        while parents[root] != root:
+            root = parents[root]
+        while parents[index] != root:
+            parents[index], index = root, parents[index]
+        return root
+
+    def union(self, first, second):
+        first = self.find(first)
+        second = self.find(second)
+        if first == second:
+            return
+        if self.sizes[first] < self.sizes[second]:
+            first, second = second, first
+        self.parents[second] = first
+        self.sizes[first] = self.sizes[first] + self.sizes.pop(second)
+
+    def tile_opened(self, x, y):
+        width = self.tiles.width
+        index = y * width + x
+        if self.parents[index] != -1:
+            return
+        self.parents[index] = index
+        self.sizes[index] = 1
+        for nx, ny in neighbours(x, y):
+            if nx >= 0 and ny >= 0 and nx < width and ny < self.tiles.height:
+                neighbour = ny * width + nx
+                if self.parents[neighbour] != -1:
+                    self.union(index, neighbour)
+
+    def tile_closed(self, x, y):
+        # Components cannot be split : never happens while playing
+        self.build()
+
+    def component(self, x, y):
+        """Serve the component of an open tile, or None."""
+        index = y * self.tiles.width + x
+        if self.parents[index] == -1:
+            return None
+        return self.find(index)
+
+    def connected(self, ox, oy, dx, dy):
+        origin = self.component(ox, oy)
+        return origin is not None and origin == self.component(dx, dy)
+
+class FlowRoute(object):
+    """A route that walks downhill on a flow field, from wherever the
+    employee currently stands. It is over once next to a dig target."""
+    def __init__(self, field, location):
+        self.field = field
+        self.location = location
+
+    def walk(self):
+        step = self.field.next_step(self.location.x, self.location.y)
+        if step is None:
+            return None, None
+        return step
+
+class FlowField(object):
+    """A Dijkstra distance field shared by all the employees sent to the
+    same dig region. Every open tile stores its distance to the closest
+    open tile next to a target (a seed), and the seed it leads to.
+    Tiles leading to the same seed form its basin : when a seed stops
+    touching any target, only its basin has to be computed again."""
+    def __init__(self, tiles, targets = ()):
+        self.tiles = tiles
+        self.targets = set(targets)
+        self.distances = {}
+        self.sources = {}
+        self.basins = {}
+        # The field is only computed when someone walks on it
+        self.built = False
+
+    def is_open(self, x, y):
+        return x >= 0 and y >= 0 and x < self.tiles.width \
+                and y < self.tiles.height and not self.tiles.is_solid(x, y)
+
+    def is_seed(self, x, y):
+        if not self.is_open(x, y):
+            return False
+        for tile in neighbours(x, y):
+            if tile in self.targets:
+                return True
+        return False
+
+    def build(self):
+        self.distances = {}
+        self.sources = {}
+        self.basins = {}
+        frontier = []
+        for target in self.targets:
+            for tile in neighbours(target[0], target[1]):
+                if tile not in self.sources and self.is_open(tile[0], tile[1]):
+                    self.set_distance(tile, 0, tile)
+                    frontier.append((0, tile))
+        self.propagate(frontier)
+        self.built = True
+
+    def set_distance(self, tile, distance, source):
+        previous = self.sources.get(tile)
+        if previous is not None:
+            self.basins[previous].discard(tile)
+        self.distances[tile] = distance
+        self.sources[tile] = source
+        self.basins.setdefault(source, set()).add(tile)
+
+    def propagate(self, frontier):
+        """Run Dijkstra from the given (distance, tile) entries."""
+        heapify(frontier)
+        while frontier:
+            distance, tile = heappop(frontier)
+            if distance > self.distances.get(tile, INFINITY):
+                continue
+            source = self.sources[tile]
+            x, y = tile
+            for nx, ny in neighbours(x, y):
+                if nx == x or ny == y:
+                    cost = distance + 1
+                else:
+                    cost = distance + DIAGONAL_COST
+                if cost < self.distances.get((nx, ny), INFINITY) \
+                        and self.is_open(nx, ny):
+                    self.set_distance((nx, ny), cost, source)
+                    heappush(frontier, (cost, (nx, ny)))
+
+    def forget(self, seeds):
+        """Drop the basins of seeds that do not touch a target anymore,
+        and let the distances around flow back into them."""
+        lost = set()
+        for seed in seeds:
+            lost.update(self.basins.pop(seed, ()))
+        for tile in lost:
+            del self.distances[tile]
+            del self.sources[tile]
+        frontier = []
+        for tile in lost:
+            for neighbour in neighbours(tile[0], tile[1]):
+                if neighbour in self.distances:
+                    frontier.append((self.distances[neighbour], neighbour))
+        self.propagate(frontier)
+
+    def add_target(self, x, y):
+        self.targets.add((x, y))
+        if not self.built:
+            return
+        frontier = []
+        for tile in neighbours(x, y):
+            if self.distances.get(tile) != 0 and self.is_open(tile[0], tile[1]):
+                self.set_distance(tile, 0, tile)
+                frontier.append((0, tile))
+        self.propagate(frontier)
+
+    def remove_target(self, x, y):
+        self.targets.discard((x, y))
+        if not self.built:
+            return
+        self.forget([tile for tile in neighbours(x, y)
+                    if self.sources.get(tile) == tile
+                    and not self.is_seed(tile[0], tile[1])])
+
+    def tile_opened(self, x, y):
+        if not self.built:
+            return
+        if self.is_seed(x, y):
+            self.set_distance((x, y), 0, (x, y))
+            frontier = [(0, (x, y))]
+        else:
+            frontier = [(self.distances[tile], tile) for tile in neighbours(x, y)
+                        if tile in self.distances]
+        self.propagate(frontier)
+
+    def tile_closed(self, x, y):
+        # Never happens while playing : simply start again
+        self.built = False
+
+    def merge(self, other):
+        self.targets.update(other.targets)
+        self.built = False
+
+    def distance(self, x, y):
+        if not self.built:
+            self.build()
+        return self.distances.get((x, y))
+
+    def end_of_route(self, x, y):
+        """Serve where going downhill from (x, y) ends."""
+        step = (x, y)
+        while step is not None:
+            x, y = step
+            step = self.next_step(x, y)
+        return x, y
+
+    def next_step(self, x, y):
+        """Serve the neighbour to go to from (x, y), or None when already
+        next to a target or when no target can be reached."""
+        distance = self.distance(x, y)
+        if not distance:
+            return None
+        best = None
+        best_cost = INFINITY
+        for nx, ny in neighbours(x, y):
+            neighbour_distance = self.distances.get((nx, ny))
+            if neighbour_distance is None:
+                continue
+            if nx == x or ny == y:
+                cost = neighbour_distance + 1
+            else:
+                cost = neighbour_distance + DIAGONAL_COST
+            if neighbour_distance < distance and cost <= best_cost:
+                best = (nx, ny)
+                best_cost = cost
+        return best
+
+def neighbours(x, y):
+    return [(x-1, y-1), (x, y-1), (x+1, y-1),
+           (x-1, y), (x+1, y),
+           (x-1, y+1), (x, y+1), (x+1, y+1)]
+
+class PathEngine(object):
+    """The interface of path engines. An engine is built from the tile
+    grid, and told about each change of solidity by FacilityPath.
+    Paths are tuples of steps, without the origin and ending with the
+    destination ; they are empty when there is no path."""
+    # Whether paths are as short as possible
+    optimal = True
+
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    def path(self, ox, oy, dx, dy):
+        raise NotImplementedError()
+
+    def solidity_changed(self, x, y, solid):
+        pass
+
+    def close(self):
+        """Free the resources of the engine, which cannot be used anymore."""
+        pass
+
+class HierarchicalPaths(PathEngine):
+    """HPA* style pathfinding. The map is cut into square chunks. Inside a
+    chunk, open tiles are split into connected components. Wherever two
+    components of neighbouring chunks touch, one pair of tiles is kept as
+    an entrance : the abstract graph links entrances across chunk borders,
+    and entrances of the same component with their distance inside the
+    chunk. A path is searched on this graph, then refined chunk by chunk.
+    Digging a tile only rebuilds its chunk and the borders around it.
+    Paths are close to the shortest ones, but not always as short."""
+    optimal = False
+
+    def __init__(self, tiles, size = 16):
+        super(HierarchicalPaths, self).__init__(tiles)
+        self.size = size
+        self.columns = (tiles.width + size - 1) // size
+        self.rows = (tiles.height + size - 1) // size
+        # Component of each open tile, by chunk
+        self.components = {}
+        # Entrance pairs, by couple of neighbouring chunks
+        self.borders = {}
+        # Entrances of each chunk, and the entrances facing them
+        self.entrances = {}
+        self.crossings = {}
+        # Distances between the entrances of a chunk, computed when needed
+        self.edges = {}
+        for cy in range(self.rows):
+            for cx in range(self.columns):
+                self.components[(cx, cy)] = self.find_components((cx, cy))
+                self.entrances[(cx, cy)] = set()
+        for cy in range(self.rows):
+            for cx in range(self.columns):
+                for other in ((cx + 1, cy), (cx, cy + 1),
+                              (cx + 1, cy + 1), (cx - 1, cy + 1)):
+                    if self.is_chunk(other):
+                        self.update_border((cx, cy), other)
+
+    def is_chunk(self, chunk):
+        return chunk[0] >= 0 and chunk[1] >= 0 \
+                and chunk[0] < self.columns and chunk[1] < self.rows
+
+    def chunk_of(self, x, y):
+        return (x // self.size, y // self.size)
+
+    def bounds(self, chunk):
+        x0 = chunk[0] * self.size
+        y0 = chunk[1] * self.size
+        return (x0, y0, min(x0 + self.size, self.tiles.width),
+                min(y0 + self.size, self.tiles.height))
+
+    def is_open(self, x, y):
+        return x >= 0 and y >= 0 and x < self.tiles.width \
+                and y < self.tiles.height and not self.tiles.is_solid(x, y)
+
+    def find_components(self, chunk):
+        """Flood fill the open tiles of a chunk."""
+        x0, y0, x1, y1 = self.bounds(chunk)
+        components = {}
+        count = 0
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                if (x, y) in components or self.tiles.is_solid(x, y):
+                    continue
+                components[(x, y)] = count
+                stack = [(x, y)]
+                while stack:
+                    tx, ty = stack.pop()
+                    for nx, ny in neighbours(tx, ty):
+                        if nx >= x0 and ny >= y0 and nx < x1 and ny < y1 \
+                                and (nx, ny) not in components \
+                                and not self.tiles.is_solid(nx, ny):
+                            components[(nx, ny)] = count
+                            stack.append((nx, ny))
+                count = count + 1
+        return components
+
+    def crossing_pairs(self, chunk, other):
+        """All the moves from a tile of chunk to a tile of other."""
+        x0, y0, x1, y1 = self.bounds(chunk)
+        ox0, oy0, ox1, oy1 = self.bounds(other)
+        if other[1] == chunk[1]:
+            tiles = [(x1 - 1, y) for y in range(y0, y1)]
+        elif other[0] == chunk[0]:
+            tiles = [(x, y1 - 1) for x in range(x0, x1)]
+        elif other[0] > chunk[0]:
+            tiles = [(x1 - 1, y1 - 1)]
+        else:
+            tiles = [(x0, y1 - 1)]
+        pairs = []
+        for x, y in tiles:
+            for nx, ny in neighbours(x, y):
+                if nx >= ox0 and ny >= oy0 and nx < ox1 and ny < oy1:
+                    pairs.append(((x, y), (nx, ny)))
+        return pairs
+
+    def update_border(self, chunk, other):
+        """Choose one entrance for each couple of components touching
+        across the border. Serve True if the entrances changed."""
+        components = self.components[chunk]
+        other_components = self.components[other]
+        groups = {}
+        for a, b in self.crossing_pairs(chunk, other):
+            if a in components and b in other_components:
+                key = (components[a], other_components[b])
+                groups.setdefault(key, []).append((a, b))
+        entrances = sorted(pairs[len(pairs) // 2] for pairs in groups.values())
+        key = (chunk, other)
+        previous = self.borders.get(key, [])
+        if previous == entrances:
+            return False
+        for a, b in previous:
+            self.crossings[a].remove(b)
+            self.crossings[b].remove(a)
+        for a, b in entrances:
+            self.crossings.setdefault(a, []).append(b)
+            self.crossings.setdefault(b, []).append(a)
+        self.borders[key] = entrances
+        for side in (chunk, other):
+            self.entrances[side] = set(tile for tile in
+                            self.entrances_around(side)
+                            if len(self.crossings.get(tile, ())) > 0)
+            self.edges.pop(side, None)
+        return True
+
+    def border_keys(self, chunk):
+        """The borders of a chunk with its (up to 8) neighbours."""
+        cx, cy = chunk
+        keys = []
+        for dx, dy in ((1, 0), (0, 1), (1, 1), (-1, 1)):
+            for first, second in (((cx, cy), (cx + dx, cy + dy)),
+                                  ((cx - dx, cy - dy), (cx, cy))):
+                if self.is_chunk(first) and self.is_chunk(second):
+                    keys.append((first, second))
+        return keys
+
+    def entrances_around(self, chunk):
+        for key in self.border_keys(chunk):
+            for pair in self.borders.get(key, ()):
+                yield pair[0] if key[0] == chunk else pair[1]
+
+    def solidity_changed(self, x, y, solid):
+        chunk = self.chunk_of(x, y)
+        self.components[chunk] = self.find_components(chunk)
+        self.edges.pop(chunk, None)
+        for first, second in self.border_keys(chunk):
+            self.update_border(first, second)
+
+    def local_search(self, chunk, start, goals = None):
+        """Dijkstra from start, without leaving the chunk. Stops once all
+        the goals are reached. Serve the distances and predecessors."""
+        x0, y0, x1, y1 = self.bounds(chunk)
+        distances = {start : 0}
+        previous = {}
+        remaining = set(goals) if goals is not None else None
+        frontier = [(0, start)]
+        while frontier:
+            distance, tile = heappop(frontier)
+            if distance > distances[tile]:
+                continue
+            if remaining is not None:
+                remaining.discard(tile)
+                if not remaining:
+                    break
+            x, y = tile
+            for nx, ny in neighbours(x, y):
+                if nx < x0 or ny < y0 or nx >= x1 or ny >= y1 \
+                        or self.tiles.is_solid(nx, ny):
+                    continue
+                if nx == x or ny == y:
+                    cost = distance + 1
+                else:
+                    cost = distance + DIAGONAL_COST
+                if cost < distances.get((nx, ny), INFINITY):
+                    distances[(nx, ny)] = cost
+                    previous[(nx, ny)] = tile
+                    heappush(frontier, (cost, (nx, ny)))
+        return distances, previous
+
+    def chunk_edges(self, chunk):
+        """Distances between the entrances of a chunk."""
+        edges = self.edges.get(chunk)
+        if edges is None:
+            edges = {}
+            entrances = self.entrances[chunk]
+            for entrance in entrances:
+                distances, previous = self.local_search(chunk, entrance,
+                                                        entrances)
+                edges[entrance] = [(other, distances[other])
+                                    for other in entrances
+                                    if other != entrance and other in distances]
+            self.edges[chunk] = edges
+        return edges
+
+    def links(self, chunk, tile):
+        """Distances from a tile to the entrances of its chunk."""
+        distances, previous = self.local_search(chunk, tile,
+                                                self.entrances[chunk])
+        return [(entrance, distances[entrance])
+                for entrance in self.entrances[chunk]
+                if entrance != tile and entrance in distances]
+
+    def path(self, ox, oy, dx, dy):
+        """Serve the steps from origin to destination, or an empty tuple."""
+        origin = (ox, oy)
+        destination = (dx, dy)
+        if origin == destination or not self.is_open(ox, oy) \
+                or not self.is_open(dx, dy):
+            return ()
+        start_chunk = self.chunk_of(ox, oy)
+        end_chunk = self.chunk_of(dx, dy)
+        # Temporary edges for the origin and the destination
+        extra = {origin : self.links(start_chunk, origin)}
+        for entrance, cost in self.links(end_chunk, destination):
+            extra.setdefault(entrance, []).append((destination, cost))
+        if start_chunk == end_chunk:
+            distances, previous = self.local_search(start_chunk, origin,
+                                                    [destination])
+            if destination in distances:
+                extra[origin].append((destination, distances[destination]))
+        nodes = self.abstract_search(origin, destination, extra)
+        if nodes is None:
+            return ()
+        steps = []
+        for a, b in zip(nodes, nodes[1:]):
+            if self.chunk_of(a[0], a[1]) != self.chunk_of(b[0], b[1]):
+                steps.append(b)
+            else:
+                steps.extend(self.refine(a, b))
+        return tuple(steps)
+
+    def abstract_search(self, origin, destination, extra):
+        """A* on the entrances. Serve the list of nodes, or None."""
+        distances = {origin : 0}
+        previous = {}
+        frontier = [(octile(origin, destination), origin)]
+        while frontier:
+            estimate, node = heappop(frontier)
+            if node == destination:
+                nodes = [node]
+                while node in previous:
+                    node = previous[node]
+                    nodes.append(node)
+                nodes.reverse()
+                return nodes
+            distance = distances[node]
+            if estimate > distance + octile(node, destination):
+                continue
+            links = list(extra.get(node, ()))
+            if node != origin:
+                chunk = self.chunk_of(node[0], node[1])
+                links.extend(self.chunk_edges(chunk).get(node, ()))
+            for other in self.crossings.get(node, ()):
+                if other[0] == node[0] or other[1] == node[1]:
+                    links.append((other, 1))
+                else:
+                    links.append((other, DIAGONAL_COST))
+            for other, cost in links:
+                cost = distance + cost
+                if cost < distances.get(other, INFINITY):
+                    distances[other] = cost
+                    previous[other] = node
+                    heappush(frontier, (cost + octile(other, destination),
+                                        other))
+        return None
+
+    def refine(self, a, b):
+        """The steps from a to b, two tiles of the same chunk."""
+        distances, previous = self.local_search(self.chunk_of(a[0], a[1]),
+                                                a, [b])
+        steps = [b]
+        while previous[steps[-1]] != a:
+            steps.append(previous[steps[-1]])
+        steps.reverse()
+        return steps
+
+def octile(a, b):
+    """An admissible estimation of the distance between two tiles."""
+    dx = abs(a[0] - b[0])
+    dy = abs(a[1] - b[1])
+    return max(dx, dy) + (DIAGONAL_COST - 1) * min(dx, dy)
+
+class LibtcodPathEngine(PathEngine):
+    """A* computed by libtcod, on a libtcod map kept in sync with the
+    tiles. The GIL is released while a path is computed."""
+    def __init__(self, tiles):
+        super(LibtcodPathEngine, self).__init__(tiles)
+        self.walkmap = build_walkmap(tiles)
+        self.handles = PathHandlePool(self.walkmap)
+
+    def solidity_changed(self, x, y, solid):
+        libtcod.map_set_properties(self.walkmap, x, y, not solid, not solid)
+
+    def path(self, ox, oy, dx, dy):
+        path = self.handles.acquire()
+        libtcod.path_compute(path, ox, oy, dx, dy)
+        steps = path_steps(path)
+        self.handles.release(path)
+        return steps
+
+    def close(self):
+        self.handles.close()
+        libtcod.map_delete(self.walkmap)
+        self.walkmap = None
+
+class PathHandlePool(object):
+    """Hands out libtcod path handles on the walk map, and takes them back
+    once their steps are read, so that native memory does not grow with
+    each search. There are never more live handles than searches running
+    at the same time."""
+    def __init__(self, walkmap):
+        self.walkmap = walkmap
+        self.free = []
+        # Handles allocated and not deleted yet, in use or not
+        self.live = 0
+        self.lock = Lock()
+
+    def acquire(self):
+        with self.lock:
+            if len(self.free) > 0:
+                return self.free.pop()
+            self.live = self.live + 1
+        return libtcod.path_new_using_map(self.walkmap, 1.41)
+
+    def release(self, path):
+        with self.lock:
+            self.free.append(path)
+
+    def in_use(self):
+        return self.live - len(self.free)
+
+    def close(self):
+        """Delete the handles that are not in use."""
+        with self.lock:
+            for path in self.free:
+                libtcod.path_delete(path)
+            self.live = self.live - len(self.free)
+            self.free = []
+
+class NumpyPathEngine(PathEngine):
+    """Paths computed with NumPy only, for machines without libtcod.
+    Distances to the destination spread from it as a vectorized wavefront
+    over a boolean array of open tiles : each round relaxes all the
+    neighbours of the tiles improved by the previous one. The array has a
+    closed border, so that neighbours never fall outside of it."""
+    def __init__(self, tiles):
+        super(NumpyPathEngine, self).__init__(tiles)
+        self.stride = tiles.width + 2
+        solid = numpy.frombuffer(bytes(tiles.solid), dtype = numpy.uint8)
+        self.open = numpy.zeros((tiles.height + 2, self.stride), dtype = bool)
+        self.open[1:-1, 1:-1] = solid.reshape(tiles.height, tiles.width) == 0
+        self.open = self.open.ravel()
+        stride = self.stride
+        self.offsets = numpy.array([-stride - 1, -stride, -stride + 1, -1, 1,
+                                    stride - 1, stride, stride + 1])
+        self.costs = numpy.array([DIAGONAL_COST, 1, DIAGONAL_COST, 1, 1,
+                                DIAGONAL_COST, 1, DIAGONAL_COST])
+
+    def index(self, x, y):
+        return (y + 1) * self.stride + x + 1
+
+    def solidity_changed(self, x, y, solid):
+        self.open[self.index(x, y)] = not solid
+
+    def distance_field(self, dx, dy, ox = None, oy = None):
+        """Distances from every open tile to the destination. When an
+        origin is given, stop as soon as its distance is final : after
+        n rounds, every path of n steps or less has been tried, and a
+        longer one costs more than n."""
+        distances = numpy.full(self.open.size, INFINITY)
+        target = self.index(dx, dy)
+        distances[target] = 0
+        origin = self.index(ox, oy) if ox is not None else None
+        frontier = numpy.array([target])
+        rounds = 0
+        while frontier.size > 0:
+            if origin is not None and rounds >= distances[origin]:
+                break
+            rounds = rounds + 1
+            candidates = (frontier[:, None] + self.offsets).ravel()
+            costs = (distances[frontier][:, None] + self.costs).ravel()
+            improved = self.open[candidates] & (costs < distances[candidates])
+            candidates = candidates[improved]
+            numpy.minimum.at(distances, candidates, costs[improved])
+            frontier = numpy.unique(candidates)
+        return distances
+
+    def path(self, ox, oy, dx, dy):
+        if (ox, oy) == (dx, dy) or not self.open[self.index(dx, dy)]:
+            return ()
+        distances = self.distance_field(dx, dy, ox, oy)
+        current = self.index(ox, oy)
+        if distances[current] == INFINITY:
+            return ()
+        steps = []
+        target = self.index(dx, dy)
+        while current != target:
+            around = current + self.offsets
+            current = int(around[numpy.argmin(distances[around] + self.costs)])
+            steps.append((current % self.stride - 1,
+                        current // self.stride - 1))
+        return tuple(steps)
+
+class JumpPointPathEngine(PathEngine):
+    """Jump Point Search : A* on a uniform cost grid, where straight and
+    diagonal runs are scanned instead of expanding every tile on them.
+    Only the tiles where a run has to turn (jump points) enter the open
+    list. Moves may cut corners, like with libtcod, and paths are as
+    short as the A* ones. Scans read a copy of the solidity with a closed
+    border, indexed like the NumPy engine one."""
+    def __init__(self, tiles):
+        super(JumpPointPathEngine, self).__init__(tiles)
+        self.stride = tiles.width + 2
+        self.blocked = bytearray([1]) * (self.stride * (tiles.height + 2))
+        for y in range(tiles.height):
+            row = tiles.index(0, y)
+            start = self.index(0, y)
+            self.blocked[start:start + tiles.width] = \
+                    tiles.solid[row:row + tiles.width]
+
+    def index(self, x, y):
+        return (y + 1) * self.stride + x + 1
+
+    def solidity_changed(self, x, y, solid):
+        self.blocked[self.index(x, y)] = 1 if solid else 0
+
+    def estimate(self, first, second):
+        """Octile distance between two indexes."""
+        dx = abs(first % self.stride - second % self.stride)
+        dy = abs(first // self.stride - second // self.stride)
+        if dx < dy:
+            return dy + (DIAGONAL_COST - 1) * dx
+        return dx + (DIAGONAL_COST - 1) * dy
+
+    def path(self, ox, oy, dx, dy):
+        origin = self.index(ox, oy)
+        destination = self.index(dx, dy)
+        if origin == destination or self.blocked[destination]:
+            return ()
+        estimate = self.estimate
+        distances = {origin : 0}
+        parents = {}
+        frontier = [(estimate(origin, destination), origin)]
+        while frontier:
+            total, node = heappop(frontier)
+            if node == destination:
+                return self.expand(node, parents)
+            distance = distances[node]
+            if total > distance + estimate(node, destination):
+                continue
+            for step in self.directions(node, parents.get(node)):
+                point = self.jump(node, step, destination)
+                if point is None:
+                    continue
+                cost = distance + estimate(node, point)
+                if cost < distances.get(point, INFINITY):
+                    distances[point] = cost
+                    parents[point] = node
+                    heappush(frontier, (cost + estimate(point, destination),
+                                        point))
+        return ()
+
+    def direction(self, node, parent):
+        """The (dx, dy) of the run from parent to node."""
+        stride = self.stride
+        dx = node % stride - parent % stride
+        dy = node // stride - parent // stride
+        return (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+
+    def directions(self, node, parent):
+        """The steps worth scanning from a jump point : the natural ones,
+        going on from the parent, and the forced ones, opened by an
+        obstacle next to the node."""
+        stride = self.stride
+        blocked = self.blocked
+        if parent is None:
+            return [-stride - 1, -stride, -stride + 1, -1, 1,
+                    stride - 1, stride, stride + 1]
+        dx, dy = self.direction(node, parent)
+        dy = dy * stride
+        if dx != 0 and dy != 0:
+            steps = [dx, dy, dx + dy]
+            if blocked[node - dx]:
+                steps.append(dy - dx)
+            if blocked[node - dy]:
+                steps.append(dx - dy)
+        elif dx != 0:
+            steps = [dx]
+            if blocked[node + stride]:
+                steps.append(dx + stride)
+            if blocked[node - stride]:
+                steps.append(dx - stride)
+        else:
+            steps = [dy]
+            if blocked[node + 1]:
+                steps.append(dy + 1)
+            if blocked[node - 1]:
+                steps.append(dy - 1)
+        return steps
+
+    def jump(self, node, step, destination):
+        """Scan from node, one step at a time. Serve the first jump point
+        met, or None if the scan hits a wall."""
+        blocked = self.blocked
+        stride = self.stride
+        if step in (-1, 1):
+            up = -stride
+            down = stride
+        elif step in (-stride, stride):
+            up = -1
+            down = 1
+        else:
+            # Diagonal : split the step in its horizontal and vertical parts
+            dx = 1 if (step - 1) % stride == 0 else -1
+            dy = step - dx
+            jump = self.jump
+            while True:
+                node = node + step
+                if blocked[node]:
+                    return None
+                if node == destination:
+                    return node
+                if (blocked[node - dx] and not blocked[node - dx + dy]) \
+                        or (blocked[node - dy] and not blocked[node + dx - dy]):
+                    return node
+                # A diagonal run stops where a straight run finds something
+                if jump(node, dx, destination) is not None \
+                        or jump(node, dy, destination) is not None:
+                    return node
+        while True:
+            node = node + step
+            if blocked[node]:
+                return None
+            if node == destination:
+                return node
+            if (blocked[node + up] and not blocked[node + up + step]) \
+                    or (blocked[node + down] and not blocked[node + down + step]):
+                return node
+
+    def expand(self, node, parents):
+        """Turn the jump points leading to node into steps."""
+        stride = self.stride
+        steps = []
+        while node in parents:
+            parent = parents[node]
+            dx, dy = self.direction(node, parent)
+            step = dx + dy * stride
+            while node != parent:
+                steps.append((node % stride - 1, node // stride - 1))
+                node = node - step
+        steps.reverse()
+        return tuple(steps)
+
+def path_steps(path):
+    """Empty a computed libtcod path into a tuple of steps. Walking it is
+    much cheaper than path_get, which follows the path from its start."""
+    steps = []
+    x, y = libtcod.path_walk(path, False)
+    while x is not None:
+        steps.append((x, y))
+        x, y = libtcod.path_walk(path, False)
+    return tuple(steps)
+
+def build_walkmap(tiles):
+    """Return a libtcod map where only the open tiles are walkable."""
+    walkmap = libtcod.map_new(tiles.width, tiles.height)
+    libtcod.map_clear(walkmap, False, False)
+    for x, y in tiles.open_tiles_in(0, 0, tiles.width - 1, tiles.height - 1):
+        libtcod.map_set_properties(walkmap, x, y, True, True)
+    return walkmap
+
+# The engines a facility can be built with
+ENGINES = {'libtcod' : LibtcodPathEngine,
+           'numpy' : NumpyPathEngine,
+           'hierarchical' : HierarchicalPaths,
+           'jps' : JumpPointPathEngine}
+
+def default_engine():
+    """libtcod if its shared library is there, NumPy otherwise."""
+    if libtcod is not None:
+        return LibtcodPathEngine
+    elif numpy is not None:
+        return NumpyPathEngine
+    return HierarchicalPaths
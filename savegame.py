@@ -0,0 +1,578 @@
+"""This module saves a facility to a binary file, and loads it back.
+
+A save is a fixed size header, then the tile arrays, one byte per tile
+each, then the state of the random generator, the employees (a column of
+ints per field), the task records and the elevator records. Integers are
+little-endian. The tile arrays come first, at a known offset : loading
+maps them in memory rather than reading them, so that tiles are only read
+from the disk when used, and only copied when dug.
+
+Paths and assignments are not saved : employees busy with a task come
+back idle, and their task queued again.
+
+The autosave does not rewrite the save : it appends what changed to a
+journal next to it, which is folded into the save when it grows too
+large, or when the save is loaded."""
+
+import gc
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from random import Random
+from threading import Thread
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from constants import TICK_LENGTH
+from facility import SecureFacility, TileGrid, Task, Elevator, Location
+from messaging import Message
+
+MAGIC = b'SECF'
+VERSION = 1
+
+# Magic, version, width, height, employees, tasks, elevators,
+# ticks, scheduler clock, task sequence, time accumulator
+HEADER = struct.Struct('<4sHHHIII QQq d')
+# Mersenne Twister words, and the gaussian draw kept for later if any
+RANDOM = struct.Struct('<625I B d')
+# Columns of the employee store saved, in this order
+EMPLOYEE_COLUMNS = ('x', 'y', 'dirX', 'dirY', 'employeeType')
+# x, y, type, priority, key, status (a Task status)
+TASK = struct.Struct('<iiBiqB')
+# x, y, dirX, dirY, cabin position, stopping, number of floors, of calls
+# and of destinations : the depths of each follow
+ELEVATOR = struct.Struct('<iiiiiBHHH')
+
+TASK_TYPES = (Message.DIG,)
+
+# A journal is a series of records : kind, size of what follows
+RECORD = struct.Struct('<BI')
+CHUNK, EMPLOYEES, TASKS, ELEVATORS, STATE, COMMIT = range(1, 7)
+COUNT = struct.Struct('<I')
+CHUNK_NUMBER = struct.Struct('<H')
+# Ticks, scheduler clock, task sequence, time accumulator : the random
+# state follows
+CLOCKS = struct.Struct('<QQq d')
+
+class Image(object):
+    """What a save holds. Tasks are (x, y, type) keys to (priority, key,
+    status), in queue order ; elevators are packed records."""
+    def __init__(self, width, height, solid, resistance):
+        self.width = width
+        self.height = height
+        self.solid = solid
+        self.resistance = resistance
+        self.ticks = 0
+        self.now = 0
+        self.sequence = 0
+        self.accumulator = 0
+        self.random = None
+        self.employees = [() for column in EMPLOYEE_COLUMNS]
+        self.tasks = OrderedDict()
+        self.elevators = []
+
+def image_of(facility):
+    image = bare_image_of(facility)
+    add_tasks(image, saved_tasks(facility))
+    return image
+
+def bare_image_of(facility, copy = False):
+    """The image of a facility, tasks left out. With copy, the image has
+    its own arrays : it can be written while the facility changes."""
+    tiles = facility.tiles
+    if copy:
+        image = Image(tiles.width, tiles.height, bytearray(tiles.solid),
+                    bytearray(tiles.resistance))
+    else:
+        image = Image(tiles.width, tiles.height, tiles.solid,
+                    tiles.resistance)
+    image.ticks = facility.ticks
+    image.now = facility.wakeUps.now
+    image.sequence = facility.todoList.sequence
+    image.accumulator = facility.accumulator
+    image.random = facility.random.getstate()
+    store = facility.employeeStore
+    image.employees = [getattr(store, column) for column in EMPLOYEE_COLUMNS]
+    if copy:
+        image.employees = [column[:] for column in image.employees]
+    image.elevators = [pack_elevator(elevator)
+                        for elevator in elevators_of(facility)]
+    return image
+
+def add_tasks(image, tasks):
+    for number, (task, status) in enumerate(tasks):
+        image.tasks[task_id(task)] = (task.priority, task.key, status)
+        breathe(number)
+
+def saved_tasks(facility):
+    return queue_order(task_lists(facility))
+
+def task_lists(facility):
+    """Copies of the task containers, as they are : cheap enough to be
+    taken between two ticks."""
+    return (list(facility.todoList.entries),
+            list(facility.beingDoneList.entries),
+            list(facility.buried.tasks), list(facility.parking.tasks))
+
+def queue_order(lists):
+    """(task, status) couples, in queue order. Tasks being done are
+    queued again."""
+    queued, beingDone, buried, parked = lists
+    age = lambda task: task.key
+    tasks = [(task, Task.QUEUED) for task in sorted(queued, key = age)]
+    tasks.extend((task, Task.QUEUED) for task in sorted(beingDone, key = age))
+    tasks.extend((task, Task.BURIED) for task in buried)
+    tasks.extend((task, Task.PARKED) for task in parked)
+    return tasks
+
+def task_id(task):
+    return (task.location.x, task.location.y, TASK_TYPES.index(task.taskType))
+
+def elevators_of(facility):
+    return [obj for obj in facility.objects if isinstance(obj, Elevator)]
+
+def journal_of(filename):
+    return filename + '.journal'
+
+def save(facility, filename):
+    """Write the facility to a file. The file is replaced at once, so a
+    facility loaded from it can be saved over it."""
+    write_image(image_of(facility), filename)
+
+def write_image(image, filename):
+    """Write a save. It replaces its journal too."""
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, image.width, image.height,
+                            len(image.employees[0]), len(image.tasks),
+                            len(image.elevators), image.ticks, image.now,
+                            image.sequence, image.accumulator))
+        f.write(image.solid)
+        f.write(image.resistance)
+        f.write(pack_random(image.random))
+        for column in image.employees:
+            f.write(int_bytes(column))
+        for number, (task, values) in enumerate(image.tasks.items()):
+            f.write(TASK.pack(*(task + values)))
+            breathe(number)
+        for elevator in image.elevators:
+            f.write(elevator)
+    getattr(os, 'replace', os.rename)(temporary, filename)
+    if os.path.exists(journal_of(filename)):
+        os.remove(journal_of(filename))
+
+def read_image(data, filename):
+    """The image of the save in data, tiles copied."""
+    width, height, employees, tasks, elevators, ticks, now, sequence, \
+            accumulator = read_header(data, filename)
+    size = width * height
+    offset = HEADER.size
+    image = Image(width, height, bytearray(data[offset:offset + size]),
+                bytearray(data[offset + size:offset + 2 * size]))
+    offset = offset + 2 * size
+    image.ticks = ticks
+    image.now = now
+    image.sequence = sequence
+    image.accumulator = accumulator
+    image.random = unpack_random(data, offset)
+    offset = offset + RANDOM.size
+    image.employees, offset = read_columns(data, offset, employees)
+    for number in range(tasks):
+        values = TASK.unpack_from(data, offset)
+        offset = offset + TASK.size
+        image.tasks[values[:3]] = values[3:]
+        breathe(number)
+    image.elevators, offset = read_elevators(data, offset, elevators)
+    return image
+
+def read_header(data, filename):
+    magic, version, width, height, employees, tasks, elevators, ticks, \
+            now, sequence, accumulator = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a SecFac save" % filename)
+    if version != VERSION:
+        raise ValueError("%s : unknown save version %d" % (filename, version))
+    return width, height, employees, tasks, elevators, ticks, now, \
+            sequence, accumulator
+
+def read_columns(data, offset, count):
+    columns = []
+    for column in EMPLOYEE_COLUMNS:
+        columns.append(struct.unpack_from('<%di' % count, data, offset))
+        offset = offset + 4 * count
+    return columns, offset
+
+def read_elevators(data, offset, count):
+    """Packed elevator records, as they are."""
+    elevators = []
+    for elevator in range(count):
+        floors, calls, destinations = ELEVATOR.unpack_from(data, offset)[-3:]
+        end = offset + ELEVATOR.size + 4 * (floors + calls + destinations)
+        elevators.append(bytes(data[offset:end]))
+        offset = end
+    return elevators, offset
+
+def int_bytes(values):
+    """Little-endian int32 of a sequence of ints."""
+    column = array('i', values)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    if hasattr(column, 'tobytes'):
+        return column.tobytes()
+    return column.tostring()
+
+def mapped(data, start, end):
+    """A writable view of data[start:end]. Python 2 cannot view a mmap :
+    it gets a copy."""
+    try:
+        return memoryview(data)[start:end]
+    except TypeError:
+        return bytearray(data[start:end])
+
+def pack_random(state):
+    version, words, gauss = state
+    return RANDOM.pack(*(words + (gauss is not None, gauss or 0.0)))
+
+def unpack_random(data, offset):
+    values = RANDOM.unpack_from(data, offset)
+    gauss = values[-1] if values[-2] else None
+    return (Random.VERSION, tuple(values[:-2]), gauss)
+
+def pack_elevator(elevator):
+    location = elevator.location
+    depths = elevator.floors + elevator.call_at + elevator.destinations
+    return ELEVATOR.pack(location.x, location.y, location.dirX,
+                        location.dirY, elevator.cabin_position,
+                        elevator.stopping, len(elevator.floors),
+                        len(elevator.call_at), len(elevator.destinations)) \
+            + struct.pack('<%di' % len(depths), *depths)
+
+def load(filename, engine = None, path_threads = 0,
+        tick_length = TICK_LENGTH, path_processes = 0):
+    """Build the facility saved in a file. Its tiles stay mapped to the
+    file : pages are read when used, and copied when written to, so that
+    the file itself is never changed."""
+    if os.path.exists(journal_of(filename)):
+        compact(filename)
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_COPY)
+    # All that is built lives as long as the facility : collecting garbage
+    # meanwhile would only go through it again and again
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        width, height, employees, tasks, elevators, ticks, now, sequence, \
+                accumulator = read_header(data, filename)
+        size = width * height
+        offset = HEADER.size
+        tiles = TileGrid(width, height, mapped(data, offset, offset + size),
+                        mapped(data, offset + size, offset + 2 * size))
+        offset = offset + 2 * size
+        facility = SecureFacility(tiles, engine, path_threads, tick_length,
+                                path_processes = path_processes)
+        facility.random.setstate(unpack_random(data, offset))
+        offset = offset + RANDOM.size
+        facility.ticks = ticks
+        facility.wakeUps.now = now
+        facility.accumulator = accumulator
+        offset = load_employees(facility, data, offset, employees)
+        offset = load_tasks(facility, data, offset, tasks, sequence)
+        offset = load_elevators(facility, data, offset, elevators)
+        return facility
+    finally:
+        if collecting:
+            gc.enable()
+
+def load_employees(facility, data, offset, count):
+    columns, offset = read_columns(data, offset, count)
+    for x, y, dirX, dirY, employeeType in zip(*columns):
+        facility.add_employee(employeeType, (x, y))
+        facility.employees[-1].location.moveTowards(dirX, dirY)
+    return offset
+
+def load_tasks(facility, data, offset, count, sequence):
+    """Tasks are added in bulk : queued ones in one heap build, buried
+    ones at once, and dig regions as they were, without looking for
+    regions to merge."""
+    locations = []
+    queued = []
+    buried = []
+    values = struct.unpack_from('<' + TASK.format.lstrip('<') * count,
+                                data, offset)
+    offset = offset + TASK.size * count
+    fields = iter(values)
+    for x, y, taskType, priority, key, status in zip(*[fields] * 6):
+        task = Task(TASK_TYPES[taskType], (x, y), priority)
+        # Keep its age
+        task.key = key
+        if task.taskType == Message.DIG:
+            facility.queuedDigs[(x, y)] = task
+            locations.append((x, y))
+        if status == Task.QUEUED:
+            queued.append(task)
+        elif status == Task.BURIED:
+            buried.append(task)
+        else:
+            facility.parking.park(task, facility.parking.regions_around(task))
+    facility.todoList.add_all(queued)
+    facility.todoIndex.add_all(queued)
+    facility.buried.park_all(buried)
+    facility.todoList.sequence = sequence
+    facility.circulation.add_dig_regions(dig_regions(locations))
+    return offset
+
+def dig_regions(locations):
+    """Group dig targets by the tiles they touch : the regions add_dig
+    and add_dig_area make, one flow field each."""
+    left = set(locations)
+    regions = []
+    for location in locations:
+        if location not in left:
+            continue
+        left.remove(location)
+        region = [location]
+        border = [location]
+        while border:
+            x, y = border.pop()
+            for tile in ((x - 1, y - 1), (x, y - 1), (x + 1, y - 1),
+                        (x - 1, y), (x + 1, y),
+                        (x - 1, y + 1), (x, y + 1), (x + 1, y + 1)):
+                if tile in left:
+                    left.remove(tile)
+                    region.append(tile)
+                    border.append(tile)
+        regions.append(region)
+    return regions
+
+def load_elevators(facility, data, offset, count):
+    elevators = []
+    for number in range(count):
+        elevator, offset = load_elevator(data, offset)
+        elevators.append(elevator)
+    facility.objects.extend(elevators)
+    return offset
+
+def load_elevator(data, offset):
+    x, y, dirX, dirY, cabin, stopping, floors, calls, destinations = \
+            ELEVATOR.unpack_from(data, offset)
+    offset = offset + ELEVATOR.size
+    count = floors + calls + destinations
+    depths = list(struct.unpack_from('<%di' % count, data, offset))
+    offset = offset + 4 * count
+    elevator = Elevator(Location(x, y))
+    elevator.location.moveTowards(dirX, dirY)
+    elevator.floors = depths[:floors]
+    elevator.call_at = depths[floors:floors + calls]
+    elevator.destinations = depths[floors + calls:]
+    elevator.cabin_position = cabin
+    elevator.stopping = bool(stopping)
+    return elevator, offset
+
+def compact(filename):
+    """Fold the journal of a save into it."""
+    with open(filename, 'rb') as f:
+        image = read_image(f.read(), filename)
+    with open(journal_of(filename), 'rb') as f:
+        apply_journal(image, f.read())
+    write_image(image, filename)
+
+def apply_journal(image, data):
+    """Apply the snapshots of a journal, in order. A snapshot only counts
+    once its COMMIT is written : the end of a journal cut by a crash is
+    left out. Records hold states, not differences, so applying one twice
+    does no harm."""
+    pending = []
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        kind, size = RECORD.unpack_from(data, offset)
+        offset = offset + RECORD.size
+        if offset + size > len(data):
+            break
+        if kind == COMMIT:
+            for record in pending:
+                apply_record(image, *record)
+            pending = []
+        else:
+            pending.append((kind, data[offset:offset + size]))
+        offset = offset + size
+
+def apply_record(image, kind, payload):
+    if kind == CHUNK:
+        chunk = CHUNK_NUMBER.unpack_from(payload, 0)[0]
+        size = (len(payload) - CHUNK_NUMBER.size) // 2
+        start = chunk * TileGrid.CHUNK_ROWS * image.width
+        middle = CHUNK_NUMBER.size + size
+        image.solid[start:start + size] = payload[CHUNK_NUMBER.size:middle]
+        image.resistance[start:start + size] = payload[middle:]
+    elif kind == EMPLOYEES:
+        count = COUNT.unpack_from(payload, 0)[0]
+        image.employees = read_columns(payload, COUNT.size, count)[0]
+    elif kind == TASKS:
+        offset = COUNT.size
+        for number in range(COUNT.unpack_from(payload, 0)[0]):
+            values = TASK.unpack_from(payload, offset)
+            offset = offset + TASK.size
+            if values[-1] == Task.DONE:
+                image.tasks.pop(values[:3], None)
+            else:
+                image.tasks[values[:3]] = values[3:]
+            breathe(number)
+    elif kind == ELEVATORS:
+        count = COUNT.unpack_from(payload, 0)[0]
+        image.elevators = read_elevators(payload, COUNT.size, count)[0]
+    elif kind == STATE:
+        image.ticks, image.now, image.sequence, image.accumulator = \
+                CLOCKS.unpack_from(payload, 0)
+        image.random = unpack_random(payload, CLOCKS.size)
+
+def record(kind, payload = b''):
+    return RECORD.pack(kind, len(payload)) + payload
+
+def breathe(number):
+    """In long loops of the autosave thread : let the game thread run now
+    and then, rather than at the interpreter's switch interval."""
+    if number % 256 == 255:
+        time.sleep(0)
+
+class Autosave(object):
+    """Save a facility in the background, a little at a time.
+
+    The journal starts from a full save : the game thread only copies
+    the arrays and lists the tasks, the thread writes them.
+    Then, between two ticks, the game thread takes a snapshot of what
+    changed since the last one : copies of the tile chunks written to and
+    of the employee columns, the tasks whose status changed, the elevators
+    and the clocks. The thread appends it to the journal of the save, and
+    folds the journal into the save once it is larger than the save."""
+    # Ticks between two snapshots
+    PERIOD = 20
+
+    def __init__(self, facility, filename, period = PERIOD):
+        self.facility = facility
+        self.filename = filename
+        self.period = period
+        # What snapshots cost the game thread, in ms
+        self.snapshots = 0
+        self.first = 0
+        self.longest = 0
+        self.total = 0
+        self.written = 0
+        self.compactions = 0
+        # Last written, not to write them again if they did not change
+        self.employees = None
+        self.elevators = None
+        self.queue = Queue()
+        self.thread = Thread(target = self.write_snapshots)
+        self.thread.daemon = True
+        self.thread.start()
+        self.full_snapshot()
+
+    def full_snapshot(self):
+        start = time.time()
+        facility = self.facility
+        image = bare_image_of(facility, copy = True)
+        self.queue.put((self.write_save, (image, task_lists(facility))))
+        facility.tiles.changedChunks = set()
+        facility.taskChanges = {}
+        self.last = facility.wakeUps.now
+        self.first = (time.time() - start) * 1000
+        self.longest = max(self.longest, self.first)
+
+    def update(self):
+        """Call between ticks : take a snapshot when it is time."""
+        if self.facility.wakeUps.now - self.last >= self.period:
+            self.snapshot()
+
+    def snapshot(self):
+        start = time.time()
+        facility = self.facility
+        tiles = facility.tiles
+        size = TileGrid.CHUNK_ROWS * tiles.width
+        chunks = [(chunk, bytes(tiles.solid[chunk * size:(chunk + 1) * size]),
+                    bytes(tiles.resistance[chunk * size:(chunk + 1) * size]))
+                    for chunk in tiles.changedChunks]
+        tiles.changedChunks = set()
+        store = facility.employeeStore
+        employees = [getattr(store, column)[:] for column in EMPLOYEE_COLUMNS]
+        # Only the status of a task changes : the task itself can be shared
+        tasks = facility.taskChanges
+        facility.taskChanges = {}
+        elevators = [pack_elevator(elevator)
+                    for elevator in elevators_of(facility)]
+        state = CLOCKS.pack(facility.ticks, facility.wakeUps.now,
+                            facility.todoList.sequence, facility.accumulator) \
+                + pack_random(facility.random.getstate())
+        self.queue.put((self.write, (chunks, employees, tasks, elevators,
+                                    state)))
+        self.last = facility.wakeUps.now
+        elapsed = (time.time() - start) * 1000
+        self.snapshots = self.snapshots + 1
+        self.total = self.total + elapsed
+        self.longest = max(self.longest, elapsed)
+
+    def write_snapshots(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+            write, arguments = snapshot
+            write(*arguments)
+
+    def write_save(self, image, tasks):
+        add_tasks(image, queue_order(tasks))
+        write_image(image, self.filename)
+        self.employees = image.employees
+        self.elevators = image.elevators
+
+    def write(self, chunks, employees, tasks, elevators, state):
+        records = [record(CHUNK, CHUNK_NUMBER.pack(chunk) + solid + resistance)
+                    for chunk, solid, resistance in chunks]
+        if employees != self.employees:
+            records.append(record(EMPLOYEES, COUNT.pack(len(employees[0]))
+                            + b''.join(int_bytes(column)
+                                    for column in employees)))
+            self.employees = employees
+        if tasks:
+            packed = [COUNT.pack(len(tasks))]
+            for number, (task, status) in enumerate(tasks.items()):
+                packed.append(TASK.pack(*(task_id(task) +
+                                    (task.priority, task.key, status))))
+                breathe(number)
+            records.append(record(TASKS, b''.join(packed)))
+        if elevators != self.elevators:
+            records.append(record(ELEVATORS, COUNT.pack(len(elevators))
+                                            + b''.join(elevators)))
+            self.elevators = elevators
+        records.append(record(STATE, state))
+        records.append(record(COMMIT))
+        data = b''.join(records)
+        journal = journal_of(self.filename)
+        with open(journal, 'ab') as f:
+            f.write(data)
+        self.written = self.written + len(data)
+        if os.path.getsize(journal) > os.path.getsize(self.filename):
+            compact(self.filename)
+            self.compactions = self.compactions + 1
+
+    def close(self):
+        """Take a last snapshot, wait for the journal to be written, and
+        stop."""
+        self.snapshot()
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {'snapshots' : self.snapshots,
+                'first ms' : self.first,
+                'longest ms' : self.longest,
+                'mean ms' : self.total / self.snapshots
+                            if self.snapshots > 0 else 0,
+                'written' : self.written,
+                'compactions' : self.compactions}
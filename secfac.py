@@ -2,23 +2,133 @@
 # -*- coding: utf-8 -*-
 # Prototype code for SecFac
 
-import libtcodpy as libtcod
-from secfacUI import FacilityMap, Screen, MenuItem, MenuPane, Prompt, Selection
-from sys import argv
-from messaging import Messenger, Message, message_parser, messages
+import argparse
+import time
+import zlib
+from messaging import Message, message_parser, messages
 from facility import buildFacility
-from constants import WIDTH, HEIGHT, EmployeeType
+from savegame import Autosave
+from ai import EmployeeBehaviour
+from pathing import ENGINES
+from constants import WIDTH, HEIGHT, GROUND, TICK_LENGTH, EmployeeType
 
-def handle_arguments():
-    no_commands = len(argv) > 1 and argv[1] == "noc"
-    if not no_commands:
-        commands = read_command_file()
-        for command in commands:
-            # Remove the \n and make upper caps
-            command = command[:-1].upper()
-            messages.receive(message_parser(command))
+def parse_arguments(arguments = None):
+    parser = argparse.ArgumentParser(description = "SecFac prototype.")
+    parser.add_argument('--headless', action = 'store_true',
+                        help = "Run the simulation without any console.")
+    parser.add_argument('--ticks', type = int, default = 1000,
+                        help = "Number of ticks of a headless run.")
+    parser.add_argument('--commands', metavar = 'FILE',
+                        help = "Apply the orders of a command file first.")
+    parser.add_argument('--engine', choices = sorted(ENGINES.keys()),
+                        help = "Path engine of the facility.")
+    parser.add_argument('--threads', type = int, default = 0,
+                        help = "Threads computing paths.")
+    parser.add_argument('--processes', type = int, default = 0,
+                        help = "Processes computing paths, "
+                        "at most one per spare core.")
+    parser.add_argument('--tick-length', type = int, default = TICK_LENGTH,
+                        help = "Simulated time of a tick, in ms.")
+    parser.add_argument('--seed', type = int,
+                        help = "Seed of the random decisions : a headless "
+                                "run is seeded with 0 by default.")
+    parser.add_argument('--autosave', metavar = 'FILE',
+                        help = "Save in the background to this file.")
+    return parser.parse_args(arguments)
 
-def main_game_loop(facility, consoles):
+def build_from_arguments(arguments):
+    engine = None
+    if arguments.engine is not None:
+        engine = ENGINES[arguments.engine]
+    seed = arguments.seed
+    if seed is None and arguments.headless:
+        # Runs to compare must be reproducible
+        seed = 0
+    return buildFacility(engine, arguments.threads, arguments.tick_length,
+                        seed, arguments.processes)
+
+def apply_commands(facility, filename):
+    """Give the orders of a command file to the facility. Return the
+    number of orders given."""
+    given = 0
+    for command in read_command_file(filename):
+        command = command.strip().upper()
+        if not command:
+            continue
+        message = message_parser(command)
+        if message.getVerb() == Message.DISPLAY:
+            # Parsing error : tell, and go on
+            print("%s : %s" % (command, message.complement()))
+        else:
+            facility.command(message)
+            given = given + 1
+    return given
+
+def run_headless(arguments):
+    """Run the simulation as fast as possible, without console nor
+    rendering. Serve the statistics of the run."""
+    facility = build_from_arguments(arguments)
+    autosave = None
+    try:
+        orders = 0
+        if arguments.commands is not None:
+            orders = apply_commands(facility, arguments.commands)
+        if arguments.autosave is not None:
+            autosave = Autosave(facility, arguments.autosave)
+        start = time.time()
+        for tick in range(arguments.ticks):
+            facility.update_employees()
+            if autosave is not None:
+                autosave.update()
+        elapsed = time.time() - start
+        stats = headless_stats(facility, arguments.ticks, elapsed, orders)
+        if autosave is not None:
+            autosave.close()
+            stats['autosave'] = autosave.stats()
+        return stats
+    finally:
+        facility.circulation.close()
+
+def headless_stats(facility, ticks, elapsed, orders):
+    tiles = facility.tiles
+    dug = 0
+    for x in range(tiles.width):
+        for y in range(GROUND + 1, tiles.height):
+            if not tiles.is_solid(x, y):
+                dug = dug + 1
+    return {'orders' : orders,
+            'ticks' : ticks,
+            'seconds' : elapsed,
+            'ticks per second' : ticks / elapsed if elapsed > 0 else 0,
+            'employees' : len(facility.employees),
+            'idle' : facility.employeeStore.count('state',
+                                            EmployeeBehaviour.WANDER),
+            'queued' : len(facility.todoList),
+            'being done' : len(facility.beingDoneList),
+            'parked' : len(facility.parking),
+            'buried' : len(facility.buried),
+            'open tiles underground' : dug,
+            'path cache' : facility.circulation.cache.stats(),
+            'parking' : facility.parking.stats(),
+            'checksum' : checksum(facility)}
+
+def checksum(facility):
+    """Of the employees and the tiles at the end of a run : the same
+    seed and the same orders must give the same checksum."""
+    store = facility.employeeStore
+    state = (list(store.x), list(store.y), list(store.state),
+            list(facility.tiles.solid), list(facility.tiles.resistance))
+    return zlib.crc32(repr(state).encode('ascii')) & 0xffffffff
+
+def print_stats(stats):
+    for key in sorted(stats.keys()):
+        value = stats[key]
+        if isinstance(value, float):
+            value = "%.3f" % value
+        print("%-24s %s" % (key, value))
+
+def main_game_loop(facility, consoles, game_mode, autosave = None):
+    import libtcodpy as libtcod
     now = libtcod.sys_elapsed_milli()
     while not messages.quit:
         # Time computing
@@ -27,23 +137,31 @@ def main_game_loop(facility, consoles):
         # Model update
         messages.poll(game_mode, facility)
         facility.update(delta)
+        if autosave is not None:
+            autosave.update()
         # Display !
         consoles.display(delta)
 
 def start_console():
+    import libtcodpy as libtcod
     libtcod.console_init_root(WIDTH, HEIGHT, "FabSec", False, libtcod.RENDERER_SDL)
     libtcod.sys_set_fps(60)
+    libtcod.mouse_show_cursor(True)
 
-def read_command_file():
+def read_command_file(filename = 'commands'):
     """Debuggin' tool. Apply a series of commands."""
-    with open('commands') as f:
+    with open(filename) as f:
         content = f.readlines()
     return content
 
-if __name__ == "__main__":
+def run_game(arguments):
+    # The UI needs libtcod, a headless run does not
+    from secfacUI import FacilityMap, Screen, MenuItem, MenuPane, Prompt, \
+            Selection
     start_console()
-    libtcod.mouse_show_cursor(True)
-    facility = buildFacility()
+    facility = build_from_arguments(arguments)
+    if arguments.commands is not None:
+        apply_commands(facility, arguments.commands)
 
     # TODO : read all that from a config file
     tree = MenuItem("Main menu", '', MenuItem.ITEM_VERB, Message.VIEW, "", [
@@ -69,6 +187,16 @@ if __name__ == "__main__":
     screen = Screen(facility, menu, prompt, selection)
     game_mode = FacilityMap(menu, screen, selection)
     messages.focus = game_mode
-    # Use for debugging only, TODO : hide this, make it optional, whatever
-    main_game_loop(facility, screen)
+    autosave = None
+    if arguments.autosave is not None:
+        autosave = Autosave(facility, arguments.autosave)
+    main_game_loop(facility, screen, game_mode, autosave)
+    if autosave is not None:
+        autosave.close()
 
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.headless:
+        print_stats(run_headless(arguments))
+    else:
+        run_game(arguments)
@@ -77,6 +77,10 @@ class MenuItem(object):
 
 class FacilityMap(Focusable):
     buildings = {'ELEVATOR' : Elevator}
+    representations = {'ELEVATOR' :
+                    [[libtcod.CHAR_NW,libtcod.CHAR_HLINE, libtcod.CHAR_NE]
+                    ,[libtcod.CHAR_VLINE, ord(' '), libtcod.CHAR_VLINE]
+                    ,[libtcod.CHAR_SW, libtcod.CHAR_HLINE, libtcod.CHAR_SE]]}
 
     """Handle the main gameplay state. Manage selection, move on map,
     and pane menu navigation."""
@@ -113,9 +117,9 @@ class FacilityMap(Focusable):
 
     def sendAreaMessage(self):
         if self.currentAction is not Message.VIEW:
-            for x in range(self.selection.x, self.selection.x2 + 1):
-                for y in range(self.selection.y, self.selection.y2 + 1):
-                    messages.receive(Message(self.currentAction, (x,y)))
+            messages.receive(Message(self.currentAction,
+                                    (self.selection.x, self.selection.y,
+                                    self.selection.x2, self.selection.y2)))
 
     def escape(self):
         if self.pane.can_go_back():
@@ -140,8 +144,8 @@ class FacilityMap(Focusable):
 
     def handle_complement(self):
         if self.currentAction == Message.BUILD and self.currentComplement is not None:
-            currentBuilding = self.buildings[self.currentComplement]
-            self.selection.set_crosshair(currentBuilding.representation)
+            representation = self.representations[self.currentComplement]
+            self.selection.set_crosshair(representation)
         else:
             self.selection.set_default_crosshair()
 
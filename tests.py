@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import tempfile
 import unittest
+from random import Random
+from heapq import heappush, heappop
 
 import libtcodpy as tcod
 from facility import *
+from pathing import *
 from secfac import *
+import savegame
 
 class ViewportTest(unittest.TestCase):
     MAP_SIZE_TEST_WIDTH = 200
@@ -120,56 +126,1138 @@ class ElevatorTest(unittest.TestCase):
         self.elevator.location.dirY = 1
         self.assertEquals(self.elevator.decide_next_destination(), 0)
 
-if __name__ == "__main__":
-    unittest.main()
-class ElevatorTest(unittest.TestCase):
+class TileGridTest(unittest.TestCase):
     def setUp(self):
-        self.elevator = Elevator(Location(0,4))
-        self.elevator.add_floor(8)
-        self.elevator.add_floor(16)
-        self.elevator.add_floor(24)
-        self.elevator.add_floor(32)
+        self.tiles = build_tiles()
 
-    def test_call(self):
-        self.elevator.call(8)
-        self.elevator.call(16)
-        self.assertEquals(len(self.elevator.call_at), 2)
-        self.assertTrue(self.elevator.is_called_or_has_destination())
+    def test_initial_solidity(self):
+        self.assertFalse(self.tiles.is_solid(0, GROUND))
+        self.assertTrue(self.tiles.is_solid(0, GROUND + 1))
+        self.assertTrue(self.tiles.is_solid(MAP_WIDTH - 1, MAP_HEIGHT - 1))
 
-    def test_can_go_to(self):
-        self.assertTrue(self.elevator.can_go_to(8))
-        self.assertFalse(self.elevator.can_go_to(9))
+    def test_tile_view(self):
+        tile = self.tiles[4][GROUND + 3]
+        self.assertEqual(tile.depth, GROUND + 3)
+        self.assertTrue(tile.solid)
+        self.assertEqual(tile.resistance, TileGrid.RESISTANCE)
+        self.assertEqual(len(self.tiles), MAP_WIDTH)
+        self.assertEqual(len(self.tiles[4]), MAP_HEIGHT)
 
-    def test_basic_destination(self):
-        self.elevator.call(8)
-        self.assertEquals(self.elevator.decide_next_destination(), 1)
-        self.elevator.cabin_position = 8
-        self.elevator.call(0)
-        self.assertEquals(self.elevator.decide_next_destination(), -1)
+    def test_dig(self):
+        tile = self.tiles[4][GROUND + 1]
+        for i in range(TileGrid.RESISTANCE - 1):
+            tile.dig()
+            self.assertTrue(tile.solid)
+        tile.dig()
+        self.assertFalse(self.tiles.is_solid(4, GROUND + 1))
+        # Digging an open tile does nothing
+        tile.dig()
+        self.assertEqual(tile.resistance, 0)
 
-    def test_move_continuity(self):
-        # The elevator is going down, has 1 call down left, but has 2 call up.
-        # It should keep going down.
-        self.elevator.call(0)
-        self.elevator.call(8)
-        self.elevator.call(24)
-        self.elevator.cabin_position = 16
-        self.elevator.location.dirY = 1
-        self.assertEquals(self.elevator.decide_next_destination(), 1)
+class FacilityPathTest(unittest.TestCase):
+    def setUp(self):
+        self.tiles = build_tiles()
+        self.circulation = FacilityPath(self.tiles)
+        # A shaft, and a gallery at its bottom
+        for y in range(GROUND + 1, GROUND + 12):
+            self.tiles.set_solid(10, y, False)
+        for x in range(10, 40):
+            self.tiles.set_solid(x, GROUND + 11, False)
 
-    def test_move_discontinuity(self):
-        # The elevator is going down, has 2 call up, but no call down anymore.
-        # It should move up.
-        self.elevator.call(0)
-        self.elevator.call(8)
-        self.elevator.cabin_position = 16
-        self.elevator.location.dirY = 1
-        self.assertEquals(self.elevator.decide_next_destination(), -1)
+    def test_same_path_as_walk_compute(self):
+        reference = tcod.path_new_using_function(MAP_WIDTH, MAP_HEIGHT,
+                                                walk_compute, self.tiles, 1.41)
+        tcod.path_compute(reference, 0, GROUND, 39, GROUND + 11)
+        steps = self.circulation.path_from_to(0, GROUND, 39, GROUND + 11)
+        self.assertEqual(list(steps), [tcod.path_get(reference, i)
+                            for i in range(tcod.path_size(reference))])
+        self.assertEqual(steps[-1], (39, GROUND + 11))
 
-    def test_move_need_to_stop(self):
-        # There is no call but the elevator is still moving. It should stop.
-        self.elevator.location.dirY = 1
-        self.assertEquals(self.elevator.decide_next_destination(), 0)
+    def test_dig_opens_the_map(self):
+        steps = self.circulation.path_from_to(0, GROUND, 41, GROUND + 11)
+        self.assertEqual(len(steps), 0)
+        tile = self.tiles[40][GROUND + 11]
+        while tile.solid:
+            tile.dig()
+        self.tiles.set_solid(41, GROUND + 11, False)
+        steps = self.circulation.path_from_to(0, GROUND, 41, GROUND + 11)
+        self.assertEqual(steps[-1], (41, GROUND + 11))
+
+    def test_handles_are_recycled(self):
+        handles = self.circulation.engine.handles
+        for x in range(11, 40):
+            self.circulation.path_from_to(0, GROUND, x, GROUND + 11)
+        self.assertEqual(handles.live, 1)
+        self.assertEqual(handles.in_use(), 0)
+        self.circulation.close()
+        self.assertEqual(handles.live, 0)
+
+    def test_cache(self):
+        cache = self.circulation.cache
+        first = self.circulation.path_from_to(0, GROUND, 39, GROUND + 11)
+        second = self.circulation.path_from_to(0, GROUND, 39, GROUND + 11)
+        self.assertTrue(first is second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Opening a tile makes every cached route stale
+        self.tiles.set_solid(11, GROUND + 1, False)
+        third = self.circulation.path_from_to(0, GROUND, 39, GROUND + 11)
+        self.assertFalse(third is first)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+class PathCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = PathCache(2)
+        cache.put(0, 0, 1, 1, ((1, 1),))
+        cache.put(0, 0, 2, 2, ((1, 1), (2, 2)))
+        # Using the first entry makes the second one the least recent
+        self.assertEqual(cache.get(0, 0, 1, 1), ((1, 1),))
+        cache.put(0, 0, 3, 3, ())
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.get(0, 0, 2, 2) is None)
+        self.assertEqual(cache.get(0, 0, 3, 3), ())
+
+    def test_route(self):
+        route = Route(((1, 1), (2, 2)))
+        self.assertEqual(route.walk(), (1, 1))
+        self.assertEqual(len(route), 1)
+        self.assertEqual(route.walk(), (2, 2))
+        self.assertEqual(route.walk(), (None, None))
+
+class FlowFieldTest(unittest.TestCase):
+    def setUp(self):
+        self.tiles = build_tiles()
+        for x in range(0, 60):
+            self.tiles.set_solid(x, GROUND + 1, False)
+        # A block of rock to dig under the gallery
+        self.targets = [(x, y) for x in range(20, 30)
+                                for y in range(GROUND + 2, GROUND + 6)]
+        self.field = FlowField(self.tiles, self.targets)
+
+    def assertSameAsRebuilt(self):
+        rebuilt = FlowField(self.tiles, self.field.targets)
+        rebuilt.build()
+        self.assertEqual(sorted(self.field.distances.items()),
+                        sorted(rebuilt.distances.items()))
+
+    def test_distances(self):
+        self.assertEqual(self.field.distance(25, GROUND + 1), 0)
+        self.assertEqual(self.field.distance(17, GROUND + 1), 2)
+        self.assertTrue(self.field.distance(20, GROUND + 2) is None)
+
+    def test_incremental_updates(self):
+        self.field.build()
+        for x in range(20, 30):
+            self.field.remove_target(x, GROUND + 2)
+            self.tiles.set_solid(x, GROUND + 2, False)
+            self.field.tile_opened(x, GROUND + 2)
+            self.assertSameAsRebuilt()
+        self.field.add_target(40, GROUND + 2)
+        self.assertSameAsRebuilt()
+        for target in list(self.field.targets):
+            self.field.remove_target(target[0], target[1])
+        self.assertSameAsRebuilt()
+        self.assertEqual(self.field.distances, {})
+
+    def test_walk_downhill(self):
+        location = Location(0, GROUND + 1)
+        route = FlowRoute(self.field, location)
+        x, y = route.walk()
+        while x is not None:
+            location.x = x
+            location.y = y
+            x, y = route.walk()
+        self.assertEqual((location.x, location.y), (19, GROUND + 1))
+
+class DigRegionTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = buildFacility()
+        for x in range(10, 20):
+            for y in range(GROUND + 1, GROUND + 3):
+                self.facility.command(Message(Message.DIG, (x, y)))
+        for i in range(3):
+            self.facility.add_employee(EmployeeType.WORKER)
+
+    def test_regions(self):
+        circulation = self.facility.circulation
+        self.assertEqual(len(circulation.fields), 1)
+        self.assertTrue(circulation.flow_field_for(10, GROUND + 1) is not None)
+        circulation.add_dig_target(30, GROUND + 1)
+        self.assertEqual(len(circulation.fields), 2)
+        self.assertTrue(circulation.flow_field_for(30, GROUND + 1) is None)
+
+    def test_take_the_task_the_field_leads_to(self):
+        self.facility.add_employee(EmployeeType.WORKER, (30, GROUND))
+        employee = self.facility.employees[-1]
+        far = self.facility.queuedDigs[(10, GROUND + 1)]
+        employee.behaviour.take_task(far, self.facility)
+        self.assertEqual(employee.behaviour.currentTask.location.x, 19)
+        self.assertTrue(far in self.facility.todoList)
+
+    def test_workers_dig_the_region(self):
+        for tick in range(500):
+            self.facility.update_employees()
+        for x in range(10, 20):
+            for y in range(GROUND + 1, GROUND + 3):
+                self.assertFalse(self.facility.tiles.is_solid(x, y))
+        self.assertEqual(len(self.facility.todoList), 0)
+        self.assertEqual(len(self.facility.beingDoneList), 0)
+        self.assertEqual(self.facility.circulation.fields, [])
+
+class DigAreaTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        self.facility.tiles.set_solid(12, GROUND + 2, False)
+
+    def test_area(self):
+        queued = self.facility.add_dig_area(10, GROUND + 1, 19, GROUND + 3)
+        # The open tile is left out
+        self.assertEqual(queued, 29)
+        # Only the tiles next to open ones can be handed out yet
+        self.assertEqual(len(self.facility.todoList), 15)
+        self.assertEqual(len(self.facility.buried), 14)
+        circulation = self.facility.circulation
+        self.assertEqual(len(circulation.fields), 1)
+        self.assertTrue(circulation.flow_field_for(19, GROUND + 3)
+                        is not None)
+
+    def test_frontier_as_tile_by_tile(self):
+        # Open tiles inside, outside against the area, and a map edge
+        for x, y in ((0, GROUND + 6), (5, GROUND + 9), (3, GROUND + 4)):
+            self.facility.tiles.set_solid(x, y, False)
+        self.facility.add_dig_area(0, GROUND + 3, 4, GROUND + 8)
+        circulation = self.facility.circulation
+        for location, task in self.facility.queuedDigs.items():
+            self.assertEqual(task in self.facility.todoList,
+                    len(circulation.free_surrounding_tiles_of(*location)) > 0)
+
+    def test_no_duplicates(self):
+        self.facility.add_dig((10, GROUND + 1))
+        task = self.facility.peek_task_for(EmployeeType.WORKER)
+        self.facility.consume_task(task)
+        self.facility.add_dig((10, GROUND + 1))
+        self.facility.add_dig_area(10, GROUND + 1, 11, GROUND + 1)
+        self.assertEqual(self.facility.add_dig_area(11, GROUND + 1,
+                                                    10, GROUND + 1), 0)
+        self.assertEqual(len(self.facility.todoList), 1)
+        self.assertEqual(len(self.facility.circulation.fields), 1)
+
+    def test_merge_regions(self):
+        self.facility.add_dig((9, GROUND + 1))
+        self.facility.add_dig_area(10, GROUND + 1, 11, GROUND + 1)
+        self.assertEqual(len(self.facility.circulation.fields), 1)
+
+    def test_area_message(self):
+        message = message_parser("DIG AREA 10,10,12,10")
+        self.assertEqual(message.complement(), (10, 10, 12, 10))
+        self.facility.command(message)
+        self.assertEqual(len(self.facility.todoList), 3)
+
+    def test_out_of_the_map(self):
+        for order in ("DIG TILE %d,%d" % (MAP_WIDTH, GROUND + 1),
+                    "DIG TILE -1,%d" % (GROUND + 3),
+                    "DIG TILE 10,%d" % (MAP_HEIGHT + 320)):
+            self.facility.command(message_parser(order))
+        self.assertEqual(len(self.facility.queuedDigs), 0)
+        # Only the part inside the map is dug
+        self.assertEqual(self.facility.add_dig_area(-3, GROUND + 1,
+                                                    1, GROUND + 1), 2)
+        self.assertEqual(self.facility.add_dig_area(MAP_WIDTH - 2,
+                                MAP_HEIGHT - 1, MAP_WIDTH + 5,
+                                MAP_HEIGHT + 5), 2)
+        self.assertEqual(len(self.facility.queuedDigs), 4)
+
+class HierarchicalPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.tiles = build_tiles()
+        # Two galleries linked by shafts, the lower one crossing chunks
+        for x in range(0, 100):
+            self.tiles.set_solid(x, GROUND + 5, False)
+            self.tiles.set_solid(x, GROUND + 30, False)
+        for y in range(GROUND + 1, GROUND + 5):
+            self.tiles.set_solid(0, y, False)
+        for y in range(GROUND + 5, GROUND + 30):
+            self.tiles.set_solid(70, y, False)
+        self.circulation = FacilityPath(self.tiles, HierarchicalPaths)
+
+    def assertValidSteps(self, origin, steps):
+        x, y = origin
+        for step in steps:
+            self.assertEqual(max(abs(step[0] - x), abs(step[1] - y)), 1)
+            self.assertFalse(self.tiles.is_solid(step[0], step[1]))
+            x, y = step
+
+    def test_path(self):
+        steps = self.circulation.path_from_to(0, GROUND, 5, GROUND + 30)
+        self.assertValidSteps((0, GROUND), steps)
+        self.assertEqual(steps[-1], (5, GROUND + 30))
+        # The shortest path goes down the shafts : 5 + 70 + 25 + 65 tiles,
+        # minus the diagonal moves when turning
+        self.assertTrue(len(steps) <= 165)
+
+    def test_unreachable(self):
+        steps = self.circulation.path_from_to(0, GROUND, 120, GROUND + 30)
+        self.assertEqual(steps, ())
+
+    def test_dig_rebuilds_the_chunks(self):
+        for x in range(100, 121):
+            self.tiles.set_solid(x, GROUND + 30, False)
+        steps = self.circulation.path_from_to(0, GROUND, 120, GROUND + 30)
+        self.assertValidSteps((0, GROUND), steps)
+        self.assertEqual(steps[-1], (120, GROUND + 30))
+        rebuilt = HierarchicalPaths(self.tiles)
+        self.assertEqual(self.circulation.engine.borders, rebuilt.borders)
+
+class ComponentsTest(unittest.TestCase):
+    def setUp(self):
+        self.tiles = build_tiles()
+        # A cave, not connected to the surface
+        for x in range(10, 20):
+            self.tiles.set_solid(x, GROUND + 10, False)
+        self.facility = SecureFacility(self.tiles)
+
+    def test_connected(self):
+        circulation = self.facility.circulation
+        self.assertTrue(circulation.is_reachable(0, GROUND, 300, 0))
+        self.assertTrue(circulation.is_reachable(10, GROUND + 10,
+                                                19, GROUND + 10))
+        self.assertFalse(circulation.is_reachable(0, GROUND, 10, GROUND + 10))
+        self.assertFalse(circulation.is_reachable(0, GROUND, 0, GROUND + 1))
+
+    def test_dig_merges(self):
+        for y in range(GROUND + 1, GROUND + 9):
+            self.tiles.set_solid(10, y, False)
+        self.assertFalse(self.facility.circulation.is_reachable(0, GROUND,
+                                                            10, GROUND + 10))
+        # Diagonal moves are allowed
+        self.tiles.set_solid(11, GROUND + 9, False)
+        self.assertTrue(self.facility.circulation.is_reachable(0, GROUND,
+                                                            10, GROUND + 10))
+
+    def test_build_as_tile_by_tile(self):
+        # Open tiles against the map edges, and diagonal links
+        for x, y in ((0, GROUND + 3), (1, GROUND + 4), (MAP_WIDTH - 1,
+                    GROUND + 2), (MAP_WIDTH - 2, GROUND + 1), (30, GROUND + 5),
+                    (31, GROUND + 6), (29, GROUND + 6), (40, MAP_HEIGHT - 1)):
+            self.tiles.set_solid(x, y, False)
+        built = Components(self.tiles)
+        opened = self.facility.circulation.components
+        for x, y in self.tiles.open_tiles_in(0, 0, MAP_WIDTH - 1,
+                                            MAP_HEIGHT - 1):
+            for other in ((0, GROUND), (10, GROUND + 10), (0, GROUND + 3),
+                        (30, GROUND + 5), (40, MAP_HEIGHT - 1)):
+                self.assertEqual(built.connected(x, y, *other),
+                                opened.connected(x, y, *other))
+
+    def test_unreachable_task(self):
+        self.facility.add_employee(EmployeeType.WORKER)
+        self.facility.add_dig((15, GROUND + 11))
+        self.facility.update_employees()
+        employee = self.facility.employees[0]
+        self.assertTrue(employee.behaviour.is_idle())
+        self.assertEqual(self.facility.circulation.cache.misses, 0)
+
+class BatchedPathsTest(unittest.TestCase):
+    def build(self, threads):
+        facility = SecureFacility(build_tiles(), path_threads = threads)
+        for x in range(0, 60):
+            facility.tiles.set_solid(x, GROUND + 1, False)
+        for i in range(6):
+            facility.add_employee(EmployeeType.WORKER, (i * 3, GROUND))
+            # Digs far enough from each other not to share a flow field
+            facility.add_dig((10 * i + 5, GROUND + 2))
+        return facility
+
+    def routes(self, facility):
+        return [employee.behaviour.currentPath.steps
+                for employee in facility.employees]
+
+    def test_requests_are_batched(self):
+        facility = self.build(0)
+        facility.assign_tasks()
+        self.assertEqual(len(facility.circulation.requests), 6)
+        facility.circulation.resolve_requests()
+        self.assertEqual(facility.circulation.requests, [])
+        self.assertEqual(facility.circulation.cache.misses, 6)
+
+    def test_thread_pool_gives_the_same_routes(self):
+        serial = self.build(0)
+        threaded = self.build(4)
+        serial.update_employees()
+        threaded.update_employees()
+        self.assertEqual(self.routes(serial), self.routes(threaded))
+        self.assertTrue(threaded.circulation.engine.handles.live <= 4)
+        threaded.circulation.close()
+        self.assertEqual(threaded.circulation.engine.handles.live, 0)
+
+class AssignmentTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        for x in range(0, 80):
+            self.facility.tiles.set_solid(x, GROUND + 1, False)
+
+    def test_closest_worker_takes_the_task(self):
+        self.facility.add_employee(EmployeeType.WORKER, (0, GROUND))
+        self.facility.add_employee(EmployeeType.WORKER, (70, GROUND))
+        self.facility.add_dig((75, GROUND + 2))
+        self.facility.assign_tasks()
+        far, close = self.facility.employees
+        self.assertTrue(far.behaviour.is_idle())
+        self.assertEqual(close.behaviour.currentTask.location.getX(), 75)
+        self.assertEqual(self.facility.assignment['assigned'], 1)
+        self.assertEqual(self.facility.assignment['idle'], 2)
+
+    def test_woken_up_out_of_list_order(self):
+        # Something else was scheduled first : the wake-up order of the
+        # employees is not their order in the list
+        self.facility.wakeUps.schedule(object(), 1000)
+        self.test_closest_worker_takes_the_task()
+
+    def test_contested_task(self):
+        # Both workers are closest to the task at 40 ; the loser takes
+        # the other one instead of crossing the map.
+        self.facility.add_employee(EmployeeType.WORKER, (38, GROUND))
+        self.facility.add_employee(EmployeeType.WORKER, (44, GROUND))
+        self.facility.add_dig((5, GROUND + 2))
+        self.facility.add_dig((40, GROUND + 2))
+        self.facility.add_dig((70, GROUND + 2))
+        self.facility.assign_tasks()
+        tasks = [employee.behaviour.currentTask.location.getX()
+                    for employee in self.facility.employees]
+        self.assertEqual(tasks, [40, 70])
+        self.assertEqual(self.facility.assignment['distance'],
+                        2 * DIAGONAL_COST + 24 + 2 * DIAGONAL_COST)
+
+    def test_nearest(self):
+        index = self.facility.todoIndex
+        for x in range(0, MAP_WIDTH):
+            self.facility.tiles.set_solid(x, GROUND + 19, False)
+        for x in (3, 50, 200):
+            self.facility.add_dig((x, GROUND + 20))
+        task, distance = index.nearest(60, GROUND, lambda task: True)
+        self.assertEqual(task.location.getX(), 50)
+        self.assertEqual(distance, 10 + 10 * DIAGONAL_COST)
+        task, distance = index.nearest(60, GROUND,
+                                        lambda task: task.location.x != 50)
+        self.assertEqual(task.location.getX(), 3)
+
+class PriorityTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        for x in range(0, 80):
+            self.facility.tiles.set_solid(x, GROUND + 1, False)
+
+    def first_x(self):
+        return self.facility.peek_task_for(EmployeeType.WORKER).location.x
+
+    def test_urgent_first(self):
+        self.facility.add_dig((10, GROUND + 2))
+        self.facility.add_dig((11, GROUND + 2), 1)
+        self.assertEqual(self.first_x(), 11)
+        self.facility.add_dig((12, GROUND + 2), 2)
+        self.assertEqual(self.first_x(), 12)
+
+    def test_aging(self):
+        self.facility.add_dig((10, GROUND + 2))
+        self.facility.add_dig_area(20, GROUND + 2, 79, GROUND + 20)
+        # Aging counts ticks, not the tasks queued since
+        self.facility.add_dig((11, GROUND + 2), 1)
+        self.assertEqual(self.first_x(), 11)
+        self.facility.consume_task(self.facility.queuedDigs[(11, GROUND + 2)])
+        for tick in range(TaskStore.AGING + 1):
+            self.facility.wakeUps.tick()
+        # The first task waited for more than AGING ticks
+        self.facility.add_dig((12, GROUND + 2), 1)
+        self.assertEqual(self.first_x(), 10)
+
+    def test_heap_after_many_removals(self):
+        self.facility.add_dig_area(20, GROUND + 2, 79, GROUND + 20)
+        tasks = list(self.facility.todoList)
+        for task in tasks[:-1]:
+            self.facility.consume_task(task)
+        self.assertEqual(len(self.facility.todoList), 1)
+        self.assertTrue(self.facility.peek_task_for(EmployeeType.WORKER)
+                        is tasks[-1])
+
+    def test_urgent_task_gets_the_closest_worker(self):
+        self.facility.add_employee(EmployeeType.WORKER, (10, GROUND))
+        self.facility.add_employee(EmployeeType.WORKER, (14, GROUND))
+        self.facility.add_dig((12, GROUND + 2))
+        self.facility.add_dig((13, GROUND + 2))
+        self.facility.add_dig((60, GROUND + 2), 1)
+        self.facility.assign_tasks()
+        tasks = [employee.behaviour.currentTask.location.x
+                    for employee in self.facility.employees]
+        self.assertEqual(tasks, [12, 60])
+
+    def test_due_task_nobody_can_take_is_skipped(self):
+        types = Task.employeesTasksType
+        Task.employeesTasksType = dict(types)
+        Task.employeesTasksType[EmployeeType.SECURITY] = [Message.BUILD]
+        try:
+            self.facility.add_employee(EmployeeType.SECURITY, (10, GROUND))
+            # An urgent dig, and no worker to do it
+            self.facility.add_dig((12, GROUND + 2), 2)
+            for x, priority in ((12, 0), (40, 1)):
+                task = Task(Message.BUILD, (x, GROUND), priority)
+                self.facility.todoList.add(task)
+                self.facility.todoIndex.add(task)
+            self.facility.assign_tasks()
+            # The urgent task of the guard, not the closest one
+            guard = self.facility.employees[0]
+            self.assertEqual(guard.behaviour.currentTask.location.x, 40)
+        finally:
+            Task.employeesTasksType = types
+
+    def test_priority_message(self):
+        message = message_parser("DIG AREA 10,11,12,11 PRIORITY 3")
+        self.assertEqual(message.priority, 3)
+        self.facility.command(message)
+        self.assertEqual(self.facility.peek_task_for(EmployeeType.WORKER)
+                        .priority, 3)
+        message = message_parser("DIG TILE 10,20 PRIORITY HIGH")
+        self.assertEqual(message.getVerb(), Message.DISPLAY)
+
+class ParkingLotTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        self.facility.add_employee(EmployeeType.WORKER, (30, GROUND))
+        # A pocket nobody can reach, with a dig in it
+        self.facility.tiles.set_solid(30, GROUND + 5, False)
+        self.facility.add_dig((31, GROUND + 5))
+        self.task = self.facility.peek_task_for(EmployeeType.WORKER)
+
+    def test_park_unreachable(self):
+        self.facility.update_employees()
+        parking = self.facility.parking
+        self.assertTrue(self.task in parking)
+        self.assertEqual(len(self.facility.todoList), 0)
+        self.assertEqual(parking.stats()['parked'], 1)
+        # Still shown on the map
+        self.assertEqual(self.facility.extract_tasks_in(31, GROUND + 5,
+                                                    31, GROUND + 5),
+                        [self.task])
+        self.facility.update_employees()
+        self.assertEqual(parking.stats()['avoided'], 1)
+        self.assertEqual(parking.stats()['parked'], 1)
+
+    def test_release_when_region_joined(self):
+        self.facility.update_employees()
+        tiles = self.facility.tiles
+        # Digs far from the pocket release nothing
+        tiles.set_solid(100, GROUND + 1, False)
+        self.assertTrue(self.task in self.facility.parking)
+        for y in range(GROUND + 1, GROUND + 4):
+            tiles.set_solid(30, y, False)
+            self.assertTrue(self.task in self.facility.parking)
+        tiles.set_solid(30, GROUND + 4, False)
+        self.assertFalse(self.task in self.facility.parking)
+        self.assertTrue(self.task in self.facility.todoList)
+        self.assertEqual(self.facility.parking.stats()['released'], 1)
+
+    def test_reachable_by_someone_else(self):
+        self.facility.add_employee(EmployeeType.WORKER, (30, GROUND + 5))
+        self.facility.give_up_task(self.task)
+        self.assertTrue(self.task in self.facility.todoList)
+
+    def test_take_parked_dig(self):
+        self.facility.update_employees()
+        self.assertTrue(self.facility.take_dig_next_to(30, GROUND + 5)
+                        is self.task)
+        self.assertEqual(len(self.facility.parking), 0)
+
+class FrontierTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        self.facility.add_dig_area(10, GROUND + 1, 12, GROUND + 3)
+
+    def frontier(self):
+        return sorted((task.location.x, task.location.y)
+                        for task in self.facility.todoList)
+
+    def test_only_frontier_handed_out(self):
+        self.assertEqual(self.frontier(), [(10, GROUND + 1), (11, GROUND + 1),
+                                            (12, GROUND + 1)])
+        self.assertEqual(len(self.facility.buried), 6)
+        # Buried digs are still shown
+        self.assertEqual(len(self.facility.extract_tasks_in(0, 0, 20, 20)), 9)
+
+    def test_frontier_moves_with_digs(self):
+        task = self.facility.queuedDigs[(10, GROUND + 1)]
+        self.facility.consume_task(task)
+        self.facility.tiles.set_solid(10, GROUND + 1, False)
+        self.facility.done(task)
+        self.assertEqual(self.frontier(), [(10, GROUND + 2), (11, GROUND + 1),
+                                            (11, GROUND + 2), (12, GROUND + 1)])
+        self.assertEqual(len(self.facility.buried), 4)
+
+    def test_excavation(self):
+        self.facility.add_employee(EmployeeType.WORKER, (11, GROUND))
+        self.facility.add_employee(EmployeeType.WORKER, (12, GROUND))
+        for tick in range(200):
+            self.facility.update_employees()
+        self.assertEqual(len(self.facility.queuedDigs), 0)
+        self.assertEqual(len(self.facility.buried), 0)
+        self.assertEqual(self.facility.parking.stats()['parked'], 0)
+
+class FixedTimestepTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles(), tick_length = 100)
+        self.steps = 0
+        def count():
+            self.steps = self.steps + 1
+        self.facility.update_employees = count
+
+    def test_accumulate(self):
+        self.assertEqual(self.facility.update(60), 0)
+        self.assertEqual(self.facility.update(60), 1)
+        self.assertEqual(self.facility.accumulator, 20)
+        self.assertEqual(self.facility.update(290), 3)
+        self.assertEqual(self.facility.accumulator, 10)
+        self.assertEqual(self.steps, 4)
+
+    def test_same_speed_whatever_the_frame_rate(self):
+        for frame in range(100):
+            self.facility.update(16)
+        slow = SecureFacility(build_tiles(), tick_length = 100)
+        slow.update_employees = lambda: None
+        for frame in range(4):
+            slow.update(400)
+        self.assertEqual(self.facility.ticks, 16)
+        self.assertEqual(slow.ticks, 16)
+
+    def test_spiral_of_death_guard(self):
+        steps = self.facility.update(10050)
+        self.assertEqual(steps, SecureFacility.MAX_CATCH_UP)
+        self.assertEqual(self.facility.accumulator, 50)
+        self.assertEqual(self.facility.droppedTime, 9500)
+
+class HeadlessTest(unittest.TestCase):
+    def test_headless_run_digs_the_ordered_area(self):
+        with tempfile.NamedTemporaryFile('w', suffix = '.cmd',
+                                        delete = False) as f:
+            f.write("dig area 2,10,6,11\nrecruit worker\n")
+        try:
+            arguments = parse_arguments(['--headless', '--ticks', '300',
+                                         '--commands', f.name,
+                                         '--engine', 'hierarchical'])
+            stats = run_headless(arguments)
+            again = run_headless(arguments)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(stats['checksum'], again['checksum'])
+        self.assertEqual(stats['orders'], 2)
+        self.assertEqual(stats['employees'], 1)
+        self.assertEqual(stats['ticks'], 300)
+        self.assertEqual(stats['open tiles underground'], 10)
+        self.assertEqual(stats['queued'], 0)
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def test_due_in_order(self):
+        self.scheduler.schedule('b', 2)
+        self.scheduler.schedule('a', 2)
+        self.scheduler.schedule('c')
+        self.assertEqual(self.scheduler.due(), ['c'])
+        self.scheduler.tick()
+        self.assertEqual(self.scheduler.due(), [])
+        self.scheduler.tick()
+        # Same tick : first scheduled first
+        self.assertEqual(self.scheduler.due(), ['b', 'a'])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_reschedule_replaces(self):
+        self.scheduler.schedule('a', 5)
+        self.scheduler.schedule('a', 1)
+        self.assertEqual(self.scheduler.wake_up_of('a'), 1)
+        for tick in range(6):
+            self.scheduler.tick()
+            due = self.scheduler.due()
+            self.assertEqual(due, ['a'] if tick == 0 else [])
+
+class WakeUpTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        self.facility.add_employee(EmployeeType.WORKER, (10, GROUND))
+        self.employee = self.facility.employees[0]
+
+    def test_digger_sleeps_until_the_tile_opens(self):
+        self.facility.add_dig((10, GROUND + 1))
+        self.facility.update_employees()
+        self.assertEqual(self.employee.behaviour.behaviour,
+                        EmployeeBehaviour.TASK_DO)
+        ticks = 1
+        awake = 0
+        while self.facility.tiles.is_solid(10, GROUND + 1):
+            self.facility.update_employees()
+            ticks = ticks + 1
+            awake = awake + self.facility.awake
+        # A stroke per tick, as before, but only woken up at the end
+        self.assertEqual(ticks, TileGrid.RESISTANCE)
+        self.assertEqual(awake, 1)
+
+    def test_sleeping_employee_wakes_up_for_a_task(self):
+        self.facility.wakeUps.schedule(self.employee, 50)
+        self.facility.add_dig((30, GROUND + 1))
+        self.facility.update_employees()
+        self.assertEqual(self.facility.awake, 1)
+        self.assertFalse(self.employee.behaviour.is_idle())
+
+class EmployeeStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tiles = build_tiles()
+        self.store = EmployeeStore()
+        # Walking right, walking into the rock, standing still
+        for x, y, dirX, dirY in [(5, GROUND, 1, 0), (6, GROUND, 0, 1),
+                                 (7, GROUND, 0, 0), (0, GROUND, -1, 0)]:
+            location = StoredLocation(self.store,
+                        self.store.add(x, y, EmployeeType.WORKER))
+            location.moveTowards(dirX, dirY)
+
+    def test_locations_read_the_store(self):
+        location = StoredLocation(self.store, 1)
+        self.assertEqual((location.getX(), location.getY()), (6, GROUND))
+        location.x = 12
+        self.assertEqual(self.store.x[1], 12)
+
+    def test_move_one_by_one(self):
+        self.assertEqual(self.store.move([0, 1, 2, 3], self.tiles), [0])
+        self.assertEqual(list(self.store.x), [6, 6, 7, 0])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_vectorized_move(self):
+        self.store.VECTOR_MINIMUM = 0
+        self.assertEqual(self.store.move([3, 2, 1, 0], self.tiles), [0])
+        self.assertEqual(list(self.store.x), [6, 6, 7, 0])
+        # Views are dropped when the store grows
+        self.store.add(1, GROUND, EmployeeType.WORKER)
+        self.assertEqual(self.store.count('x', 6), 2)
+        self.assertEqual(len(self.store), 5)
+
+class SeededRunTest(unittest.TestCase):
+    def run_facility(self, seed):
+        facility = SecureFacility(build_tiles(), seed = seed)
+        for x in range(0, 200, 5):
+            facility.add_employee(EmployeeType.WORKER, (x, GROUND))
+        facility.add_dig_area(20, GROUND + 1, 30, GROUND + 3)
+        for tick in range(100):
+            facility.update_employees()
+        return [(employee.location.x, employee.location.y)
+                for employee in facility.employees]
+
+    def test_same_seed_same_run(self):
+        self.assertEqual(self.run_facility(3), self.run_facility(3))
+        self.assertNotEqual(self.run_facility(3), self.run_facility(4))
+
+    def test_draws_of_a_tick_are_batched(self):
+        facility = SecureFacility(build_tiles(), seed = 1)
+        for x in range(10):
+            facility.add_employee(EmployeeType.WORKER, (x, GROUND))
+        expected = Random(1)
+        for draw in range(20):
+            expected.random()
+        facility.update_employees()
+        # Decisions and pauses all came from the batch
+        self.assertEqual(facility.random.getstate(), expected.getstate())
+        self.assertEqual(facility.draws, [])
+
+class PathProcessesTest(unittest.TestCase):
+    """Processes are started whatever the number of cores here : the
+    facility would run without them on a single core."""
+    def run_facility(self, processes):
+        facility = SecureFacility(build_tiles(), JumpPointPathEngine,
+                                seed = 5)
+        circulation = facility.circulation
+        if processes > 0:
+            circulation.processes = PathProcesses(facility.tiles,
+                                            JumpPointPathEngine, processes)
+            circulation.PROCESS_MINIMUM = 2
+        try:
+            for x in range(0, 200, 10):
+                facility.add_employee(EmployeeType.WORKER, (x, GROUND))
+            for x in range(30, 160, 20):
+                facility.add_dig_area(x, GROUND + 1, x + 2, GROUND + 4)
+            for tick in range(150):
+                facility.update_employees()
+            return ([(employee.location.x, employee.location.y)
+                    for employee in facility.employees],
+                    bytes(facility.tiles.solid))
+        finally:
+            circulation.close()
+
+    def test_same_run_as_a_single_process(self):
+        self.assertEqual(self.run_facility(3), self.run_facility(0))
+
+    def test_no_more_processes_than_spare_cores(self):
+        circulation = FacilityPath(build_tiles(), JumpPointPathEngine,
+                                    processes = 64)
+        try:
+            started = 0
+            if circulation.processes is not None:
+                started = len(circulation.processes.workers)
+            self.assertEqual(started, min(64, spare_cores()))
+        finally:
+            circulation.close()
+
+    def test_replicas_follow_the_tiles(self):
+        tiles = build_tiles()
+        engine = JumpPointPathEngine(tiles)
+        tiles.add_observer(engine)
+        processes = PathProcesses(tiles, JumpPointPathEngine, 2)
+        tiles.add_observer(processes)
+        try:
+            for y in range(GROUND + 1, GROUND + 6):
+                tiles.set_solid(12, y, False)
+            keys = [(12, GROUND + 5, 0, GROUND), (0, GROUND, 12, GROUND + 5),
+                    (0, GROUND, 40, GROUND + 5)]
+            self.assertEqual(processes.compute(keys, engine.path),
+                            [engine.path(*key) for key in keys])
+        finally:
+            processes.close()
+            engine.close()
+
+    def test_close_after_a_worker_died(self):
+        processes = PathProcesses(build_tiles(), JumpPointPathEngine, 2)
+        dead = processes.workers[0]
+        dead.terminate()
+        dead.join()
+        workers = list(processes.workers)
+        processes.close()
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+        self.assertEqual(processes.workers, [])
+
+    def test_changes_are_sent_when_too_many(self):
+        tiles = build_tiles()
+        engine = JumpPointPathEngine(tiles)
+        tiles.add_observer(engine)
+        processes = PathProcesses(tiles, JumpPointPathEngine, 1)
+        tiles.add_observer(processes)
+        try:
+            for x in range(1, 2 * PathProcesses.CHANGES_MAXIMUM):
+                tiles.set_solid(x % tiles.width, GROUND + 1 + x // tiles.width,
+                                False)
+            self.assertTrue(len(processes.changes)
+                            < PathProcesses.CHANGES_MAXIMUM)
+            # Both bands : the second one is computed by the replica
+            keys = [(0, GROUND, 150, GROUND + 1), (1, GROUND, 200, GROUND + 1)]
+            self.assertEqual(processes.compute(keys, engine.path),
+                            [engine.path(*key) for key in keys])
+        finally:
+            processes.close()
+            engine.close()
+
+class SaveGameTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix = '.sav')
+        os.close(handle)
+        self.facility = SecureFacility(build_tiles(), seed = 2)
+        for x in range(5, 50, 5):
+            self.facility.add_employee(EmployeeType.WORKER, (x, GROUND))
+        self.facility.add_dig_area(10, GROUND + 1, 30, GROUND + 4)
+        self.facility.add_dig((100, GROUND + 20), priority = 2)
+        elevator = Elevator(Location(60, 4))
+        elevator.add_floor(8)
+        elevator.call(8)
+        self.facility.add_object_on(60, 4, elevator)
+        for tick in range(30):
+            self.facility.update_employees()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_round_trip(self):
+        savegame.save(self.facility, self.filename)
+        loaded = savegame.load(self.filename)
+        self.assertEqual(bytes(loaded.tiles.solid),
+                        bytes(self.facility.tiles.solid))
+        self.assertEqual(bytes(loaded.tiles.resistance),
+                        bytes(self.facility.tiles.resistance))
+        self.assertEqual([(e.location.x, e.location.y, e.employeeType)
+                            for e in loaded.employees],
+                        [(e.location.x, e.location.y, e.employeeType)
+                            for e in self.facility.employees])
+        # Digs being done are queued again
+        digs = set(self.facility.queuedDigs) | set(self.facility.ongoingDigs)
+        self.assertEqual(set(loaded.queuedDigs), digs)
+        self.assertEqual(len(loaded.buried), len(self.facility.buried))
+        self.assertEqual(loaded.queuedDigs[(100, GROUND + 20)].key,
+                    self.facility.queuedDigs[(100, GROUND + 20)].key)
+        self.assertEqual(loaded.random.getstate(),
+                        self.facility.random.getstate())
+        elevator = loaded.objects[0]
+        self.assertEqual((elevator.floors, elevator.call_at), ([4, 8], [8]))
+
+    def test_dig_regions_stay_apart(self):
+        self.facility.add_dig_area(100, GROUND + 30, 110, GROUND + 33)
+        savegame.save(self.facility, self.filename)
+        loaded = savegame.load(self.filename)
+        area = loaded.circulation.flow_field_for(100, GROUND + 30)
+        other = loaded.circulation.flow_field_for(110, GROUND + 33)
+        self.assertTrue(area is other)
+        self.assertEqual(area.targets, self.facility.circulation
+                                .flow_field_for(100, GROUND + 30).targets)
+        # The first area is a region of its own
+        x, y = [location for location in self.facility.queuedDigs
+                if location[1] <= GROUND + 4][0]
+        first = loaded.circulation.flow_field_for(x, y)
+        self.assertFalse(first is None or first is area)
+        self.assertFalse((x, y) in area.targets)
+
+    def test_loaded_tiles_do_not_change_the_file(self):
+        savegame.save(self.facility, self.filename)
+        with open(self.filename, 'rb') as f:
+            before = f.read()
+        loaded = savegame.load(self.filename)
+        for tick in range(100):
+            loaded.update_employees()
+        self.assertNotEqual(bytes(loaded.tiles.solid),
+                            bytes(self.facility.tiles.solid))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), before)
+        # And it can be saved over its own file
+        savegame.save(loaded, self.filename)
+        self.assertEqual(bytes(savegame.load(self.filename).tiles.solid),
+                        bytes(loaded.tiles.solid))
+
+    def test_not_a_save(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'\0' * 100)
+        self.assertRaises(ValueError, savegame.load, self.filename)
+
+class AutosaveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'auto.sav')
+        self.facility = SecureFacility(build_tiles(), seed = 2)
+        for x in range(5, 50, 5):
+            self.facility.add_employee(EmployeeType.WORKER, (x, GROUND))
+        self.facility.add_dig_area(10, GROUND + 1, 30, GROUND + 4)
+        self.facility.add_dig((100, GROUND + 20), priority = 2)
+        self.autosave = savegame.Autosave(self.facility, self.filename,
+                                        period = 10)
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def run_ticks(self, ticks):
+        for tick in range(ticks):
+            self.facility.update_employees()
+            self.autosave.update()
+
+    def saved(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def content(self, filename):
+        image = savegame.read_image(self.saved(filename), filename)
+        # Tasks are in the order they were first saved : loading sorts them
+        return (image.solid, image.resistance, image.ticks, image.now,
+                image.sequence, image.random, image.employees,
+                dict(image.tasks), image.elevators)
+
+    def test_journal_gives_a_full_save(self):
+        self.run_ticks(65)
+        self.autosave.close()
+        self.assertEqual(self.autosave.snapshots, 7)
+        full = os.path.join(self.directory, 'full.sav')
+        savegame.save(self.facility, full)
+        # Loading folds the journal in the save
+        loaded = savegame.load(self.filename)
+        self.assertFalse(os.path.exists(savegame.journal_of(self.filename)))
+        self.assertEqual(self.content(self.filename), self.content(full))
+        self.assertEqual(loaded.wakeUps.now, self.facility.wakeUps.now)
+
+    def test_cut_snapshot_is_left_out(self):
+        start = self.facility.wakeUps.now
+        self.run_ticks(35)
+        self.autosave.close()
+        journal = savegame.journal_of(self.filename)
+        data = self.saved(journal)
+        with open(journal, 'wb') as f:
+            f.write(data[:-1])
+        loaded = savegame.load(self.filename)
+        self.assertEqual(loaded.wakeUps.now, start + 30)
+
+class TaskStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        for x in range(10, 15):
+            self.facility.add_dig((x, GROUND + 1))
+
+    def test_peek_in_order(self):
+        task = self.facility.peek_task_for(EmployeeType.WORKER)
+        self.assertEqual(task.location.getX(), 10)
+        # Peeking does not take the task
+        self.assertTrue(self.facility.peek_task_for(EmployeeType.WORKER)
+                        is task)
+        self.assertTrue(self.facility.peek_task_for(EmployeeType.SECURITY)
+                        is None)
+
+    def test_consume_release_done(self):
+        task = self.facility.peek_task_for(EmployeeType.WORKER)
+        self.facility.consume_task(task)
+        self.assertEqual(len(self.facility.todoList), 4)
+        self.assertTrue(task in self.facility.beingDoneList)
+        self.facility.release_task(task)
+        self.assertTrue(task in self.facility.todoList)
+        # Released tasks keep their place in the queue
+        self.assertEqual(self.facility.peek_task_for(EmployeeType.WORKER)
+                            .location.getX(), 10)
+        self.facility.consume_task(task)
+        self.facility.done(task)
+        self.assertEqual(len(self.facility.beingDoneList), 0)
+        self.assertEqual([t.location.getX() for t in self.facility.todoList],
+                        [11, 12, 13, 14])
+
+    def test_add_all_in_order(self):
+        store = TaskStore()
+        store.add_all([Task(Message.DIG, (x, GROUND + 1))
+                        for x in (14, 10, 12)])
+        store.add(Task(Message.DIG, (20, GROUND + 1), 1))
+        # Order of arrival, but urgent first
+        self.assertEqual([task.location.getX() for task in store],
+                        [20, 14, 10, 12])
+        self.assertEqual(store.peek([Message.DIG]).location.getX(), 20)
+
+class SpatialIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.facility = SecureFacility(build_tiles())
+        self.facility.tiles.set_solid(20, GROUND + 1, False)
+        self.facility.add_employee(EmployeeType.WORKER, (15, GROUND))
+        self.facility.add_employee(EmployeeType.WORKER, (40, GROUND))
+
+    def test_extract_employees(self):
+        found = self.facility.extract_employees_in(0, 0, 20, 20)
+        self.assertEqual(found, [self.facility.employees[0]])
+
+    def test_moving_employee(self):
+        employee = self.facility.employees[0]
+        employee.behaviour.set_behaviour(EmployeeBehaviour.TASK_MOVE)
+        employee.behaviour.currentPath = Route([(16, GROUND), (17, GROUND)])
+        self.facility.update_employees()
+        self.assertEqual(employee.location.x, 16)
+        # Crossed into the next cell
+        self.assertEqual(self.facility.extract_employees_in(16, 0, 20, 20),
+                        [employee])
+        self.assertEqual(self.facility.extract_employees_in(0, 0, 15, 20), [])
+
+    def test_tasks_follow_their_list(self):
+        self.facility.add_dig((20, GROUND + 2))
+        task = self.facility.peek_task_for(EmployeeType.WORKER)
+        self.assertEqual(self.facility.extract_tasks_in(0, 0, 30, 30), [task])
+        self.facility.consume_task(task)
+        self.assertEqual(self.facility.extract_tasks_in(0, 0, 30, 30), [])
+        self.assertEqual(self.facility.extract_ongoing_tasks_in(0, 0, 30, 30),
+                        [task])
+        self.facility.done(task)
+        self.assertEqual(len(self.facility.beingDoneIndex), 0)
+
+class PathEngineConformance(object):
+    """Tests every path engine must pass. Mixed with unittest.TestCase
+    for each engine."""
+    engine = None
+
+    def setUp(self):
+        self.tiles = build_tiles()
+        # A gallery and a cave linked by a twisted shaft
+        for x in range(0, 60):
+            self.tiles.set_solid(x, GROUND + 1, False)
+        for y in range(GROUND + 1, GROUND + 20):
+            self.tiles.set_solid(30 + abs(y % 4 - 2), y, False)
+        for x in range(20, 50):
+            for y in range(GROUND + 20, GROUND + 25):
+                self.tiles.set_solid(x, y, False)
+        # A closed cave
+        for x in range(100, 110):
+            self.tiles.set_solid(x, GROUND + 30, False)
+        self.paths = self.engine(self.tiles)
+        self.tiles.add_observer(self.paths)
+
+    def tearDown(self):
+        self.paths.close()
+
+    def cost(self, origin, steps):
+        """Check the steps are valid moves, and serve their cost."""
+        cost = 0
+        x, y = origin
+        for step in steps:
+            self.assertEqual(max(abs(step[0] - x), abs(step[1] - y)), 1)
+            self.assertFalse(self.tiles.is_solid(step[0], step[1]))
+            if step[0] == x or step[1] == y:
+                cost = cost + 1
+            else:
+                cost = cost + 1.41
+            x, y = step
+        return cost
+
+    def shortest(self, origin, destination):
+        """A plain Dijkstra, as a reference."""
+        distances = {origin : 0}
+        frontier = [(0, origin)]
+        while frontier:
+            distance, tile = heappop(frontier)
+            if tile == destination:
+                return distance
+            if distance > distances[tile]:
+                continue
+            for nx, ny in neighbours(tile[0], tile[1]):
+                if nx < 0 or ny < 0 or nx >= MAP_WIDTH or ny >= MAP_HEIGHT \
+                        or self.tiles.is_solid(nx, ny):
+                    continue
+                cost = distance + (1 if nx == tile[0] or ny == tile[1]
+                                    else 1.41)
+                if cost < distances.get((nx, ny), INFINITY):
+                    distances[(nx, ny)] = cost
+                    heappush(frontier, (cost, (nx, ny)))
+        return None
+
+    def test_straight_line(self):
+        steps = self.paths.path(0, GROUND + 1, 10, GROUND + 1)
+        self.assertEqual(steps, tuple((x, GROUND + 1) for x in range(1, 11)))
+
+    def test_path(self):
+        for origin, destination in (((0, GROUND), (45, GROUND + 24)),
+                                    ((49, GROUND + 20), (2, GROUND + 1)),
+                                    ((300, 0), (25, GROUND + 22))):
+            steps = self.paths.path(origin[0], origin[1],
+                                    destination[0], destination[1])
+            self.assertEqual(steps[-1], destination)
+            cost = self.cost(origin, steps)
+            if self.paths.optimal:
+                self.assertAlmostEqual(cost, self.shortest(origin, destination),
+                                        places = 3)
+
+    def test_no_path(self):
+        self.assertEqual(self.paths.path(0, GROUND, 105, GROUND + 30), ())
+        self.assertEqual(self.paths.path(0, GROUND, 0, GROUND + 5), ())
+        self.assertEqual(self.paths.path(5, GROUND, 5, GROUND), ())
+
+    def test_dig(self):
+        for y in range(GROUND + 25, GROUND + 30):
+            self.tiles.set_solid(100, y, False)
+        self.tiles.set_solid(50, GROUND + 25, False)
+        for x in range(50, 100):
+            self.tiles.set_solid(x, GROUND + 25, False)
+        steps = self.paths.path(0, GROUND, 105, GROUND + 30)
+        self.assertEqual(steps[-1], (105, GROUND + 30))
+        self.cost((0, GROUND), steps)
+
+class LibtcodPathEngineTest(PathEngineConformance, unittest.TestCase):
+    engine = LibtcodPathEngine
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class NumpyPathEngineTest(PathEngineConformance, unittest.TestCase):
+    engine = NumpyPathEngine
+
+class HierarchicalPathsConformanceTest(PathEngineConformance,
+                                        unittest.TestCase):
+    engine = HierarchicalPaths
+
+class JumpPointPathEngineTest(PathEngineConformance, unittest.TestCase):
+    engine = JumpPointPathEngine
 
 if __name__ == "__main__":
     unittest.main()
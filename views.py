@@ -47,9 +47,10 @@ class FacilityView(object):
             x = 0
 
     def display_tiles(self, console, fromx, fromy, tox, toy):
+        tiles = self.facility.tiles
         for y in range(fromy, toy):
             for x in range(fromx, tox):
-                self.tileDisplayer.execute(self.facility.tiles[x][y],
+                self.tileDisplayer.execute(y, tiles.is_solid(x, y),
                                         x-fromx, y-fromy, console)
 
     def display_tasks(self, console, tick, fromx, fromy, tox, toy):
@@ -160,16 +161,16 @@ class DisplayTileCommand(DisplayCommand):
         super(DisplayTileCommand, self).__init__(None, None)
         self.tileGetter = tileGetter
 
-    def execute(self, tile, x, y, console):
+    def execute(self, depth, solid, x, y, console):
         """For the tile painter, background and foreground properties
         will change each execution, after reading the proper information
         from the painter. Note : it could be worthwile to fuse the painter
         and this Command, here."""
-        self.background = self.tileGetter.get_background(tile.depth, tile.solid)
-        self.foreground = self.tileGetter.get_foreground(tile.depth, tile.solid)
+        self.background = self.tileGetter.get_background(depth, solid)
+        self.foreground = self.tileGetter.get_foreground(depth, solid)
         self.set_foreground(console, x, y)
         self.set_background(console, x, y)
-        char = self.tileGetter.get_char(tile.depth, tile.solid)
+        char = self.tileGetter.get_char(depth, solid)
         self.display_char(console, x, y, char)
 
 class TimedDisplayCommand(DisplayCommand):